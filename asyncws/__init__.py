@@ -1,4 +1,21 @@
 from .protocol import *
 from .exceptions import *
+from .codec import *
+from .routing import *
+from .sinks import *
+from .capture import *
+from .tracing import *
+from .bus import *
+from .reconnect import *
+from .compression import *
+from .budget import *
+from .memory import *
+from .conflate import *
+from .rpc import *
+from .tls import *
+from .batching import *
+from .executor import *
+from .dispatcher import *
+from .archive import *
 
-__all__ = ( protocol.__all__, exceptions.__all__)
\ No newline at end of file
+__all__ = ( protocol.__all__, exceptions.__all__, codec.__all__, routing.__all__, sinks.__all__, capture.__all__, tracing.__all__, bus.__all__, reconnect.__all__, compression.__all__, budget.__all__, memory.__all__, conflate.__all__, rpc.__all__, tls.__all__, batching.__all__, executor.__all__, dispatcher.__all__, archive.__all__)
\ No newline at end of file
@@ -0,0 +1,358 @@
+import mmap
+import time
+import struct
+import bisect
+import collections
+
+from .protocol import EncodedMessage, _STREAM, _TEXT, _BINARY
+
+__all__ = ['ArchiveWriter', 'ArchiveReader']
+
+_MAGIC = b'AWSARC2\n'
+
+# flags, rsv bits, timestamp, length
+_RECORD = struct.Struct('!BBdI')
+# magic, previous index block, segment start, first record number, records, first and last timestamp
+_INDEX = struct.Struct('!4sQQQQdd')
+_INDEX_MAGIC = b'AIDX'
+
+_OPCODE = 0x0f
+_INDEX_BLOCK = 0x10
+_OMITTED = 0x20
+_SENT = 0x40
+_FIN = 0x80
+
+ArchiveRecord = collections.namedtuple('ArchiveRecord', 'number timestamp opcode fin sent payload rsv')
+
+_Segment = collections.namedtuple('_Segment', 'first_timestamp last_timestamp start end first_number count')
+
+
+class ArchiveWriter:
+    """
+    Append the data frames of websockets, or the messages of a :class:`Bus` topic, to an archive
+    file for cold storage.
+
+    Every frame is stored as it was on the wire, unmasked, behind a 14 byte header with its
+    wall clock timestamp, opcode, RSV bits and length, so archiving costs little more than a
+    buffered write. Compressed messages and batches keep their RSV1 and RSV2 bits and are
+    decoded as the websocket would, see :class:`PresetDictionary` and :class:`Batching`.
+    After each ``segment_size`` bytes an index block records where the segment starts, its first
+    record number and its time range, and points back to the previous index block. Reading with
+    :class:`ArchiveReader` then finds any record by number or timestamp by walking the index
+    blocks and scanning at most one segment.
+
+    Attach websockets with :meth:`attach`, which uses the same hooks as :class:`CaptureLog`
+    and replaces a capture log attached to them, or archive a topic with :meth:`Bus.archive`.
+
+    :param path: File the archive is written to.
+    :param segment_size: Bytes of records between index blocks.
+    :param sent: Archive the frames websockets send as well as those they receive.
+    :param buffer_size: Size of the write buffer.
+    """
+    def __init__(self, path, segment_size=1048576, sent=False, buffer_size=262144):
+        self.segment_size = segment_size
+        self.sent = sent
+        self.records = 0
+        self._file = open(path, 'wb', buffering=buffer_size)
+        self._file.write(_MAGIC)
+        self._offset = len(_MAGIC)
+        self._previous_index = 0
+        self._start_segment()
+
+
+    def attach(self, websocket):
+        """
+        Start archiving the data frames of ``websocket``.
+        """
+        connection = _ArchivedConnection(self)
+        websocket.capture = connection
+        websocket._frame_writer.capture = connection
+        return connection
+
+
+    def append(self, data, timestamp=None, sent=False):
+        """
+        Append a complete message.
+
+        :param data: ``str``, ``bytes`` or an :class:`EncodedMessage`.
+        :param timestamp: Seconds since the epoch, the current time by default.
+        """
+        if isinstance(data, EncodedMessage):
+            opcode = data.opcode
+            payload = data.payload
+        elif isinstance(data, str):
+            opcode = _TEXT
+            payload = data.encode('utf-8')
+        else:
+            opcode = _BINARY
+            payload = data
+
+        flags = opcode | _FIN
+        if sent:
+            flags |= _SENT
+        self._append(flags, 0, time.time() if timestamp is None else timestamp, payload)
+
+
+    def flush(self):
+        self._file.flush()
+
+
+    def close(self):
+        """
+        Write the index block of the last segment and close the file. Websockets that are
+        still attached stop being archived.
+        """
+        if self._file.closed:
+            return
+        self._write_index()
+        self._file.close()
+
+
+    def _append(self, flags, rsv, timestamp, payload):
+        file = self._file
+        if file.closed:
+            return
+
+        length = len(payload)
+        file.write(_RECORD.pack(flags, rsv, timestamp, length))
+        if length:
+            file.write(payload)
+        self._offset += _RECORD.size + length
+
+        if self._count == 0:
+            self._first_timestamp = timestamp
+        self._last_timestamp = timestamp
+        self._count += 1
+        self.records += 1
+
+        if self._offset - self._segment_start >= self.segment_size:
+            self._write_index()
+
+
+    def _start_segment(self):
+        self._segment_start = self._offset
+        self._first_number = self.records
+        self._count = 0
+        self._first_timestamp = 0.0
+        self._last_timestamp = 0.0
+
+
+    def _write_index(self):
+        if self._count == 0:
+            return
+
+        index = _INDEX.pack(_INDEX_MAGIC, self._previous_index, self._segment_start, self._first_number,
+                            self._count, self._first_timestamp, self._last_timestamp)
+        self._file.write(_RECORD.pack(_INDEX_BLOCK, 0, self._last_timestamp, len(index)))
+        self._file.write(index)
+        self._previous_index = self._offset
+        self._offset += _RECORD.size + len(index)
+        self._start_segment()
+
+
+class _ArchivedConnection:
+    def __init__(self, archive):
+        self.archive = archive
+
+    def record_received(self, fin, opcode, length, payload, rsv):
+        if opcode == _TEXT or opcode == _BINARY or opcode == _STREAM:
+            self._record(fin, opcode, payload, rsv, 0)
+
+    def record_sent(self, fin, opcode, payload, rsv):
+        if self.archive.sent and (opcode == _TEXT or opcode == _BINARY or opcode == _STREAM):
+            self._record(fin, opcode, payload, rsv, _SENT)
+
+    def record_closed(self):
+        pass
+
+    def _record(self, fin, opcode, payload, rsv, flags):
+        flags |= opcode
+        if fin:
+            flags |= _FIN
+        if payload is None:
+            # written to a binary sink as it arrived
+            flags |= _OMITTED
+            payload = b''
+        self.archive._append(flags, rsv, time.time(), payload)
+
+
+class ArchiveReader:
+    """
+    Random access to an archive written by :class:`ArchiveWriter`, through a memory map.
+
+    Records are numbered from 0 in the order they were appended::
+
+        with ArchiveReader('feed.arc') as archive:
+            for record in archive.records(archive.find(time.time() - 3600)):
+                print(record.timestamp, record.payload)
+
+    Opening a cleanly closed archive only reads its index blocks. An archive that is still being
+    written, or was not closed, has no index block at its end and its record headers are scanned
+    once instead.
+
+    :param path: Archive file.
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._map = None
+        self._segments = []
+        try:
+            if self._file.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError('not an archive')
+            if self._file.seek(0, 2) > len(_MAGIC):
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._load_index()
+        except BaseException:
+            self.close()
+            raise
+
+        self._first_numbers = [segment.first_number for segment in self._segments]
+        self._last_timestamps = [segment.last_timestamp for segment in self._segments]
+
+
+    def __len__(self):
+        if not self._segments:
+            return 0
+        last = self._segments[-1]
+        return last.first_number + last.count
+
+
+    def __iter__(self):
+        return self.records()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+    def find(self, timestamp):
+        """
+        :return: Number of the first record stamped at or after ``timestamp``, or the number of \
+            records if there is none.
+        """
+        position = bisect.bisect_left(self._last_timestamps, timestamp)
+        if position == len(self._segments):
+            return len(self)
+
+        segment = self._segments[position]
+        number = segment.first_number
+        for offset, flags, rsv, record_timestamp, length in self._headers(segment.start, segment.end):
+            if record_timestamp >= timestamp:
+                return number
+            number += 1
+        return number
+
+
+    def read(self, number):
+        """
+        :return: The record numbered ``number`` as an ``ArchiveRecord``.
+        :raises IndexError: When there is no such record.
+        """
+        for record in self.records(number):
+            return record
+        raise IndexError('archive record out of range')
+
+
+    def records(self, start=0):
+        """
+        Iterate over the records from number ``start`` on.
+
+        :return: Generator of ``ArchiveRecord`` tuples. ``payload`` is ``bytes``, or ``None`` for \
+            frames that were written to a binary sink instead of being received in memory. ``rsv`` \
+            holds the frame's RSV bits, RSV1 for a compressed message and RSV2 for a batch.
+        """
+        position = bisect.bisect_right(self._first_numbers, start) - 1
+        if start < 0 or position < 0:
+            return
+
+        data = self._map
+        number = self._segments[position].first_number
+        for segment in self._segments[position:]:
+            for offset, flags, rsv, timestamp, length in self._headers(segment.start, segment.end):
+                if number >= start:
+                    payload = None
+                    if not flags & _OMITTED:
+                        payload = data[offset + _RECORD.size:offset + _RECORD.size + length]
+                    yield ArchiveRecord(number, timestamp, flags & _OPCODE, bool(flags & _FIN),
+                                        bool(flags & _SENT), payload, rsv)
+                number += 1
+
+
+    def _headers(self, start, end):
+        data = self._map
+        offset = start
+        while offset + _RECORD.size <= end:
+            flags, rsv, timestamp, length = _RECORD.unpack_from(data, offset)
+            if offset + _RECORD.size + length > end:
+                # cut off while it was being written
+                return
+            if not flags & _INDEX_BLOCK:
+                yield offset, flags, rsv, timestamp, length
+            offset += _RECORD.size + length
+
+
+    def _read_index(self, offset):
+        flags, _, _, length = _RECORD.unpack_from(self._map, offset)
+        if not flags & _INDEX_BLOCK or length != _INDEX.size:
+            return None
+        index = _INDEX.unpack_from(self._map, offset + _RECORD.size)
+        if index[0] != _INDEX_MAGIC:
+            return None
+        return index
+
+
+    def _load_index(self):
+        size = len(self._map)
+        last = size - _RECORD.size - _INDEX.size
+        index = self._read_index(last) if last >= len(_MAGIC) else None
+
+        if index is not None:
+            # closed cleanly, follow the index blocks back to the start
+            end = last
+            while index is not None:
+                _, previous, start, first_number, count, first_timestamp, last_timestamp = index
+                self._segments.append(_Segment(first_timestamp, last_timestamp, start, end, first_number, count))
+                if previous == 0:
+                    break
+                end = previous
+                index = self._read_index(previous)
+            self._segments.reverse()
+            return
+
+        # no index at the end, scan the record headers
+        start = len(_MAGIC)
+        number = 0
+        count = 0
+        first_timestamp = last_timestamp = 0.0
+        offset = start
+        while offset + _RECORD.size <= size:
+            flags, _, timestamp, length = _RECORD.unpack_from(self._map, offset)
+            if offset + _RECORD.size + length > size:
+                break
+            following = offset + _RECORD.size + length
+            if flags & _INDEX_BLOCK:
+                if count:
+                    self._segments.append(_Segment(first_timestamp, last_timestamp, start, offset, number, count))
+                number += count
+                count = 0
+                start = following
+            else:
+                if count == 0:
+                    first_timestamp = timestamp
+                last_timestamp = timestamp
+                count += 1
+            offset = following
+
+        if count:
+            self._segments.append(_Segment(first_timestamp, last_timestamp, start, offset, number, count))
@@ -0,0 +1,90 @@
+from .exceptions import *
+
+__all__ = ['Batching']
+
+
+class Batching:
+    """
+    Pack small messages sent close together into a single frame.
+
+    For messages of a few dozen bytes the frame header and the work of receiving each frame
+    cost more than the payload. With batching, messages shorter than ``max_message`` are held
+    for up to ``window`` seconds, or until ``max_size`` bytes have piled up, and then sent as one
+    binary frame marked with the RSV2 bit. Each message in it is prefixed with a varint of its
+    length shifted left by one, the low bit set for text. The receiving websocket unpacks the
+    frame, so :meth:`Websocket.recv` still returns the messages one by one and in order.
+
+    Pass a :class:`Batching` to :func:`start_server` and :func:`connect` with the ``batching``
+    keyword. The client offers the ``x-asyncws-batch`` extension and the server accepts it if it
+    was given one too. The settings only apply to what each end sends. A send with ``flush``
+    writes the pending batch right away.
+
+    :param window: Seconds a message may wait for others to join it.
+    :param max_size: Bytes of messages that make a batch full.
+    :param max_message: Messages of at least this many bytes are sent on their own.
+    """
+    extension = 'x-asyncws-batch'
+
+    def __init__(self, window=0.001, max_size=16384, max_message=1024):
+        self.window = window
+        self.max_size = max_size
+        self.max_message = max_message
+
+
+    def offer(self):
+        return self.extension
+
+
+    def accepts(self, name, params):
+        return name == self.extension
+
+
+    def pack(self, messages):
+        """
+        :param messages: List of ``(text, payload)`` pairs with ``bytes`` payloads.
+        :return: Envelope ``bytearray``.
+        """
+        envelope = bytearray()
+        for text, payload in messages:
+            value = len(payload) << 1 | text
+            while value > 0x7f:
+                envelope.append(value & 0x7f | 0x80)
+                value >>= 7
+            envelope.append(value)
+            envelope.extend(payload)
+        return envelope
+
+
+    def unpack(self, envelope):
+        """
+        :return: List of the ``str`` and ``bytes`` messages in ``envelope``.
+        """
+        messages = []
+        length = len(envelope)
+        offset = 0
+        while offset < length:
+            value = 0
+            shift = 0
+            while True:
+                if offset >= length or shift > 35:
+                    raise ClosedException(1002, 'invalid batch envelope')
+                byte = envelope[offset]
+                offset += 1
+                value |= (byte & 0x7f) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+
+            end = offset + (value >> 1)
+            if end > length:
+                raise ClosedException(1002, 'invalid batch envelope')
+
+            payload = bytes(envelope[offset:end])
+            offset = end
+            if value & 1:
+                try:
+                    payload = payload.decode('utf-8')
+                except Exception:
+                    raise ClosedException(1002, 'invalid utf-8 payload')
+            messages.append(payload)
+        return messages
@@ -0,0 +1,85 @@
+import time
+
+from .exceptions import *
+
+__all__ = ['MemoryBudget']
+
+
+class MemoryBudget:
+    """
+    Upper bound on the inbound message bytes buffered across all connections of a server.
+
+    Every data frame is accounted for from the moment its header is read until the message it
+    belongs to is complete and queued for the application. When a frame would take the total
+    past ``limit``, partial messages are closed with status 1009 until it fits, either the
+    ``'largest'`` or the ``'oldest'`` first. If the connection asking for room is picked, its
+    own message is refused instead.
+
+    Pass the number of bytes to :func:`start_server` as ``memory_budget``, or a
+    :class:`MemoryBudget` to share one budget between several servers. The budget in use is
+    available as ``WSServer.memory_budget``.
+
+    :param limit: Bytes that may be buffered at once.
+    :param policy: ``'largest'`` or ``'oldest'``, which partial messages to close first.
+    """
+    def __init__(self, limit, policy='largest'):
+        if policy not in ('largest', 'oldest'):
+            raise ValueError('policy must be largest or oldest')
+        self.limit = limit
+        self.policy = policy
+        self.used = 0
+        self.peak = 0
+        self.evictions = 0
+        self._partial = {}
+
+
+    def reserve(self, websocket, size):
+        """
+        Account ``size`` more bytes to the message ``websocket`` is receiving.
+
+        :raises ClosedException: When ``websocket`` itself had to give up its message.
+        """
+        if self.used + size > self.limit:
+            self._evict(websocket, size)
+
+        entry = self._partial.get(websocket)
+        if entry is None:
+            self._partial[websocket] = [size, time.monotonic()]
+        else:
+            entry[0] += size
+
+        self.used += size
+        if self.used > self.peak:
+            self.peak = self.used
+
+
+    def release(self, websocket):
+        """
+        Give back everything accounted to ``websocket``, once its message is complete or abandoned.
+        """
+        entry = self._partial.pop(websocket, None)
+        if entry is not None:
+            self.used -= entry[0]
+
+
+    def _evict(self, websocket, size):
+        if self.policy == 'largest':
+            victims = sorted(self._partial.items(), key=lambda item: item[1][0], reverse=True)
+        else:
+            victims = sorted(self._partial.items(), key=lambda item: item[1][1])
+
+        for victim, (used, _) in victims:
+            if self.used + size <= self.limit:
+                return
+
+            self.evictions += 1
+            self.release(victim)
+            if victim is websocket:
+                raise ClosedException(1009, 'memory budget exceeded')
+            victim.abort(1009, 'memory budget exceeded')
+
+        if self.used + size > self.limit:
+            # nothing left to close, the message alone is larger than the budget
+            self.evictions += 1
+            self.release(websocket)
+            raise ClosedException(1009, 'memory budget exceeded')
@@ -0,0 +1,214 @@
+import os
+import struct
+import asyncio
+
+from .protocol import EncodedMessage, encode_message
+
+__all__ = ['BusHub', 'Bus', 'start_bus_hub', 'connect_bus']
+
+# topic length, opcode, frame header length, frame length
+_RECORD = struct.Struct('!HBBI')
+
+
+class BusHub:
+    """
+    Relay between the worker processes of one host, see :func:`start_bus_hub`.
+
+    Messages are passed on to every other member without waiting for it, so one busy process
+    does not hold up the rest. A member with more than ``max_buffer`` bytes not yet written to
+    it has stopped keeping up and is disconnected, counted in :attr:`dropped`.
+
+    :param max_buffer: Most bytes waiting to be written to a single member.
+    """
+    def __init__(self, max_buffer=4194304):
+        self.max_buffer = max_buffer
+        self.dropped = 0
+        self._server = None
+        self._members = set()
+
+    @property
+    def members(self):
+        return len(self._members)
+
+    def close(self):
+        self._server.close()
+        for writer in self._members:
+            writer.close()
+
+    @asyncio.coroutine
+    def wait_closed(self):
+        yield from self._server.wait_closed()
+
+    @asyncio.coroutine
+    def _handle_member(self, reader, writer):
+        self._members.add(writer)
+        try:
+            while True:
+                header = yield from reader.readexactly(_RECORD.size)
+                topic_length, _, _, frame_length = _RECORD.unpack(header)
+                body = yield from reader.readexactly(topic_length + frame_length)
+                for member in list(self._members):
+                    if member is writer:
+                        continue
+                    if member.transport.get_write_buffer_size() > self.max_buffer:
+                        # closing would wait for the buffer to be written
+                        self._members.discard(member)
+                        self.dropped += 1
+                        member.transport.abort()
+                        continue
+                    member.write(header)
+                    member.write(body)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._members.discard(writer)
+            writer.close()
+
+
+@asyncio.coroutine
+def start_bus_hub(path, max_buffer=4194304):
+    """
+    Start the hub that carries :class:`Bus` messages between processes over a Unix domain socket.
+
+    Run the hub once per host, typically in the parent process before the workers are started,
+    and have every worker call :func:`connect_bus` with the same path. A stale socket file
+    left at ``path`` is removed.
+
+    :param path: File system path of the socket.
+    :param max_buffer: Bytes a member may fall behind by before it is disconnected, see :class:`BusHub`.
+    :return: :class:`BusHub`
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+
+    hub = BusHub(max_buffer)
+    hub._server = yield from asyncio.start_unix_server(hub._handle_member, path)
+    return hub
+
+
+class Bus:
+    """
+    Publish messages to websockets subscribed in any process attached to the same hub.
+
+    A published message is framed once with :func:`encode_message`. The frame is sent to the
+    other processes as is, and every process writes it to its own subscribers with
+    :meth:`Websocket.send_encoded`, so nothing is encoded again on the way. Websockets are
+    forgotten once they are closed. See :func:`connect_bus`.
+    """
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._topics = {}
+        self._archives = {}
+        self._recv_task = None
+
+
+    def subscribe(self, topic, websocket):
+        self._topics.setdefault(topic, set()).add(websocket)
+
+
+    def unsubscribe(self, topic, websocket):
+        subscribers = self._topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(websocket)
+            if not subscribers:
+                del self._topics[topic]
+
+
+    def unsubscribe_all(self, websocket):
+        for topic in list(self._topics):
+            self.unsubscribe(topic, websocket)
+
+
+    def archive(self, topic, archive):
+        """
+        Append every message of ``topic``, published in this or any other process, to ``archive``.
+        Archive a topic in one process only, or each process stores its own copy.
+
+        :param archive: :class:`ArchiveWriter`, ``None`` to stop archiving the topic.
+        """
+        if archive is None:
+            self._archives.pop(topic, None)
+        else:
+            self._archives[topic] = archive
+
+
+    @asyncio.coroutine
+    def publish(self, topic, data):
+        """
+        Send ``data`` to the subscribers of ``topic`` in this and every other process.
+
+        :param topic: Topic name.
+        :param data: ``str``, ``bytes`` or an :class:`EncodedMessage`.
+        """
+        message = data
+        if not isinstance(data, EncodedMessage):
+            message = encode_message(data)
+
+        name = topic.encode('utf-8')
+        self._writer.write(_RECORD.pack(len(name), message.opcode, message.offset, len(message.frame)))
+        self._writer.write(name)
+        self._writer.write(message.frame)
+
+        self._deliver(topic, message)
+        yield from self._writer.drain()
+
+
+    def close(self):
+        self._writer.close()
+        if self._recv_task is not None:
+            self._recv_task.cancel()
+
+
+    @asyncio.coroutine
+    def wait_closed(self):
+        if self._recv_task is not None:
+            try:
+                yield from self._recv_task
+            except asyncio.CancelledError:
+                pass
+
+
+    def _deliver(self, topic, message):
+        archive = self._archives.get(topic)
+        if archive is not None:
+            archive.append(message)
+
+        subscribers = self._topics.get(topic)
+        if not subscribers:
+            return
+
+        for websocket in list(subscribers):
+            if websocket._closed:
+                self.unsubscribe(topic, websocket)
+            elif not websocket._frame_writer.write_encoded(message):
+                asyncio.ensure_future(websocket.send_encoded(message))
+
+
+    @asyncio.coroutine
+    def _recv(self):
+        try:
+            while True:
+                header = yield from self._reader.readexactly(_RECORD.size)
+                topic_length, opcode, offset, frame_length = _RECORD.unpack(header)
+                name = yield from self._reader.readexactly(topic_length)
+                frame = yield from self._reader.readexactly(frame_length)
+                self._deliver(name.decode('utf-8'), EncodedMessage(opcode, frame, offset))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writer.close()
+
+
+@asyncio.coroutine
+def connect_bus(path):
+    """
+    Attach this process to the hub started by :func:`start_bus_hub`.
+
+    :param path: File system path of the hub socket.
+    :return: :class:`Bus`
+    """
+    reader, writer = yield from asyncio.open_unix_connection(path)
+    bus = Bus(reader, writer)
+    bus._recv_task = asyncio.ensure_future(bus._recv())
+    return bus
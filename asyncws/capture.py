@@ -0,0 +1,329 @@
+import time
+import struct
+import asyncio
+import hashlib
+import argparse
+import collections
+import urllib.parse
+
+from .protocol import connect, _STREAM, _TEXT, _CLOSE, _PING, _PONG, _RSV1, _RSV2
+from .batching import Batching
+from .exceptions import *
+
+__all__ = ['CaptureLog', 'read_capture', 'replay']
+
+_MAGIC = b'AWSCAP2\n'
+
+# kind, connection, timestamp, flags, rsv bits, length
+_RECORD = struct.Struct('!BIdBBQ')
+
+_OPEN = 0
+_RECEIVED = 1
+_SENT = 2
+_CLOSED = 3
+
+_FIN = 0x80
+_DIGEST = 0x40
+_OMITTED = 0x20
+_SERVER = 0x10
+
+CaptureRecord = collections.namedtuple(
+    'CaptureRecord', 'kind connection timestamp opcode fin server length payload digest rsv')
+
+
+class CaptureLog:
+    """
+    Record the frames of any number of websockets to a compact binary log.
+
+    Pass the log to :func:`start_server` or :func:`connect` with the ``capture`` keyword
+    to record every connection, or call :meth:`attach` on individual websockets. Each
+    frame is stored with a monotonic timestamp, its opcode, RSV bits and length, and either
+    the payload itself or, with ``payloads=False``, an 8 byte digest of it. Payloads are
+    stored as they were on the wire, compressed or batched frames included.
+
+    :param path: File the log is written to.
+    :param payloads: Store payloads, otherwise only their digests.
+    """
+    def __init__(self, path, payloads=True):
+        self.payloads = payloads
+        self._file = open(path, 'wb')
+        self._file.write(_MAGIC)
+        self._start = time.monotonic()
+        self._next_id = 0
+
+
+    def attach(self, websocket, path):
+        """
+        Start recording ``websocket``.
+
+        :param path: Request path the websocket was opened on, used when replaying.
+        """
+        connection = _Connection(self, self._next_id)
+        self._next_id += 1
+        flags = _SERVER if websocket.request is not None else 0
+        self._write(_OPEN, connection.id, flags, path.encode('utf-8'))
+        websocket.capture = connection
+        websocket._frame_writer.capture = connection
+        return connection
+
+
+    def flush(self):
+        self._file.flush()
+
+
+    def close(self):
+        """
+        Close the log file. Websockets that are still attached stop being recorded.
+        """
+        self._file.close()
+
+
+    def _write(self, kind, connection, flags, payload):
+        if self._file.closed:
+            return
+        self._file.write(_RECORD.pack(
+            kind, connection, time.monotonic() - self._start, flags, 0, len(payload)))
+        self._file.write(payload)
+
+
+    def _write_frame(self, kind, connection, fin, opcode, length, payload, rsv):
+        flags = opcode
+        if fin:
+            flags |= _FIN
+
+        file = self._file
+        if file.closed:
+            return
+
+        if payload is None:
+            flags |= _OMITTED
+            file.write(_RECORD.pack(kind, connection, time.monotonic() - self._start, flags, rsv, length))
+        elif self.payloads:
+            file.write(_RECORD.pack(kind, connection, time.monotonic() - self._start, flags, rsv, length))
+            file.write(payload)
+        else:
+            flags |= _DIGEST
+            file.write(_RECORD.pack(kind, connection, time.monotonic() - self._start, flags, rsv, length))
+            file.write(hashlib.sha1(payload).digest()[:8])
+
+
+class _Connection:
+    def __init__(self, log, id):
+        self.log = log
+        self.id = id
+
+    def record_received(self, fin, opcode, length, payload, rsv):
+        self.log._write_frame(_RECEIVED, self.id, fin, opcode, length, payload, rsv)
+
+    def record_sent(self, fin, opcode, payload, rsv):
+        self.log._write_frame(_SENT, self.id, fin, opcode, len(payload), payload, rsv)
+
+    def record_closed(self):
+        self.log._write(_CLOSED, self.id, 0, b'')
+
+
+def read_capture(path):
+    """
+    Iterate over the records of a log written by :class:`CaptureLog`.
+
+    :return: Generator of ``CaptureRecord`` tuples. ``payload`` is ``None`` when only a digest was \
+        stored, and for ``OPEN`` records it holds the request path. ``rsv`` holds the frame's RSV \
+        bits, RSV1 for a compressed message and RSV2 for a batch.
+    """
+    with open(path, 'rb') as file:
+        if file.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError('not a capture log')
+
+        size = _RECORD.size
+        while True:
+            header = file.read(size)
+            if len(header) < size:
+                break
+
+            kind, connection, timestamp, flags, rsv, length = _RECORD.unpack(header)
+            payload = None
+            digest = None
+            if flags & _OMITTED:
+                pass
+            elif flags & _DIGEST:
+                digest = file.read(8)
+            else:
+                payload = file.read(length)
+
+            if kind == _OPEN:
+                payload = payload.decode('utf-8')
+
+            yield CaptureRecord(kind, connection, timestamp, flags & 0x0F,
+                                bool(flags & _FIN), bool(flags & _SERVER), length, payload, digest, rsv)
+
+
+def _unbatch(record):
+    # the messages a batch frame carried
+    if record.payload is None:
+        return []
+    return Batching().unpack(record.payload)
+
+
+def _client_frames(records):
+    # group the frames that originated at the client side of each connection
+    connections = collections.OrderedDict()
+    for record in records:
+        if record.kind == _OPEN:
+            connections[record.connection] = (record, [])
+        elif record.connection in connections:
+            opened, frames = connections[record.connection]
+            sent_by_client = _RECEIVED if opened.server else _SENT
+            if record.kind == sent_by_client:
+                frames.append(record)
+    return list(connections.values())
+
+
+@asyncio.coroutine
+def _replay_connection(url, opened, frames, start, speed, close_timeout, stats, **kwds):
+    loop = asyncio.get_event_loop()
+    yield from asyncio.sleep(max(0, start + opened.timestamp / speed - loop.time()))
+
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme == 'ws+unix':
+        target = 'ws+unix://{0}:{1}'.format(parsed.path.partition(':')[0], opened.payload)
+    else:
+        target = urllib.parse.urlunparse(parsed[:2] + urllib.parse.urlparse(opened.payload)[2:])
+    websocket = yield from connect(target, **kwds)
+    stats['connections'] += 1
+
+    @asyncio.coroutine
+    def discard():
+        # read the queue itself, recv() stops returning replies once the close frame is sent
+        while True:
+            item = yield from websocket._queue.get()
+            if item is None:
+                break
+            websocket._taken(item)
+            stats['received'] += 1
+
+    discard_task = asyncio.ensure_future(discard())
+    compression = kwds.get('compression')
+    compressed = None
+    text = False
+    try:
+        for record in frames:
+            delay = start + record.timestamp / speed - loop.time()
+            if delay > 0:
+                yield from asyncio.sleep(delay)
+
+            if record.opcode == _CLOSE:
+                yield from websocket.close()
+                break
+            elif record.opcode == _PING:
+                yield from websocket.ping(record.payload or b'')
+            elif record.opcode == _PONG:
+                continue
+            elif compressed is not None or record.rsv & _RSV1:
+                # compressed messages are inflated once complete and sent as a single message
+                if compressed is None:
+                    compressed = (record.opcode, bytearray(), [])
+                compressed[1].extend(record.payload or b'')
+                compressed[2].append(record.payload is not None)
+                if not record.fin:
+                    continue
+
+                opcode, data, stored = compressed
+                compressed = None
+                try:
+                    if compression is None or not all(stored):
+                        raise ClosedException(1002, 'compressed payload not available')
+                    payload = compression.decompress(bytes(data), kwds.get('max_payload', 33554432))
+                except ClosedException:
+                    stats['skipped'] += 1
+                    continue
+
+                if opcode == _TEXT:
+                    payload = payload.decode('utf-8', 'replace')
+                yield from websocket.send(payload)
+            elif record.rsv & _RSV2:
+                if record.payload is None:
+                    stats['skipped'] += 1
+                    continue
+                for message in _unbatch(record):
+                    yield from websocket.send(message)
+            else:
+                payload = record.payload if record.payload is not None else bytes(record.length)
+                if record.opcode == _TEXT or (record.opcode == _STREAM and text):
+                    payload = payload.decode('utf-8', 'replace')
+
+                if record.opcode != _STREAM and record.fin:
+                    yield from websocket.send(payload)
+                elif record.opcode != _STREAM:
+                    text = record.opcode == _TEXT
+                    yield from websocket.send_fragment_start(payload)
+                elif not record.fin:
+                    yield from websocket.send_fragment(payload)
+                else:
+                    yield from websocket.send_fragment_end(payload)
+
+            stats['sent'] += 1
+    finally:
+        yield from websocket.close()
+        # replies keep arriving until the server answers the close frame
+        yield from asyncio.wait([websocket._recv_task], timeout=close_timeout)
+        yield from websocket.wait_closed()
+        yield from discard_task
+
+
+@asyncio.coroutine
+def replay(path, url, speed=1.0, close_timeout=5.0, **kwds):
+    """
+    Replay the client side of a capture log against a server.
+
+    Every recorded connection is opened with :func:`connect` on the path it was recorded on
+    and sends the frames its client sent, at the recorded offsets divided by ``speed``.
+    Frames whose payload was not stored are replaced by zero bytes of the same length.
+    Batches are sent as the messages they carried. Compressed messages are inflated with the
+    ``compression`` dictionary and sent whole, they are skipped without it or when their
+    payload was not stored.
+
+    :param path: Log written by :class:`CaptureLog`.
+    :param url: Websocket uri of the server, only the scheme and host are used.
+    :param speed: Replay this many times faster than recorded.
+    :param close_timeout: Seconds each connection waits for the server to answer its close frame.
+    :param kwds: Passed on to :func:`connect`.
+    :return: Dictionary with the number of ``connections`` opened, frames ``sent``, messages \
+        ``skipped`` and messages ``received``.
+    """
+    stats = {'connections': 0, 'sent': 0, 'skipped': 0, 'received': 0}
+    start = asyncio.get_event_loop().time()
+    tasks = [asyncio.ensure_future(
+                _replay_connection(url, opened, frames, start, speed, close_timeout, stats, **kwds))
+             for opened, frames in _client_frames(read_capture(path))]
+    if tasks:
+        yield from asyncio.wait(tasks)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m asyncws.capture')
+    commands = parser.add_subparsers(dest='command')
+    dump = commands.add_parser('dump', help='print the records of a capture log')
+    dump.add_argument('log')
+    play = commands.add_parser('replay', help='replay a capture log against a server')
+    play.add_argument('log')
+    play.add_argument('url')
+    play.add_argument('--speed', type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    if args.command == 'dump':
+        kinds = ('open', 'recv', 'sent', 'closed')
+        for record in read_capture(args.log):
+            print('%12.6f %6d %-6s opcode=%x fin=%d rsv=%x length=%d' % (
+                record.timestamp, record.connection, kinds[record.kind],
+                record.opcode, record.fin, record.rsv >> 4, record.length))
+    elif args.command == 'replay':
+        loop = asyncio.get_event_loop()
+        stats = loop.run_until_complete(replay(args.log, args.url, args.speed))
+        print(stats)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import json
+import collections
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+__all__ = ['Codec', 'JsonCodec', 'MsgpackCodec', 'RawCodec', 'register_codec', 'get_codec']
+
+
+class Codec:
+    """
+    Base class for message codecs used by :meth:`Websocket.send_obj` and :meth:`Websocket.recv_obj`.
+
+    Subclasses implement :meth:`encode` and :meth:`decode`. To send an object to many websockets
+    encode it once with :meth:`Websocket.encode_obj` and send the result to each of them.
+
+    :param name: Subprotocol the codec is selected by.
+    :param cache_size: Number of encoded objects :meth:`encode_cached` remembers.
+    """
+    name = None
+
+    def __init__(self, name=None, cache_size=256):
+        if name is not None:
+            self.name = name
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+
+
+    def encode(self, obj):
+        raise NotImplementedError
+
+
+    def decode(self, data):
+        raise NotImplementedError
+
+
+    def encode_cached(self, obj):
+        """
+        Encode ``obj``, reusing the encoding if the same object was encoded before. Used by
+        :meth:`Websocket.send_obj` with ``cache=True``.
+
+        Entries are found by object identity and keep their object alive until ``cache_size``
+        newer ones push them out. An object must not be modified after it has been encoded,
+        or later calls return the old encoding.
+        """
+        key = id(obj)
+        entry = self._cache.get(key)
+        # the cache holds a reference to obj so its id can not be reused while cached
+        if entry is not None and entry[0] is obj:
+            self._cache.move_to_end(key)
+            return entry[1]
+
+        data = self.encode(obj)
+        self._cache[key] = (obj, data)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return data
+
+
+class JsonCodec(Codec):
+    """
+    Encode messages as JSON text frames.
+    """
+    name = 'json'
+
+    def __init__(self, name=None, cache_size=256, **dumps_kwds):
+        Codec.__init__(self, name, cache_size)
+        dumps_kwds.setdefault('separators', (',', ':'))
+        self._dumps_kwds = dumps_kwds
+
+    def encode(self, obj):
+        return json.dumps(obj, **self._dumps_kwds)
+
+    def decode(self, data):
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """
+    Encode messages as msgpack binary frames. Requires the ``msgpack`` package.
+    """
+    name = 'msgpack'
+
+    def __init__(self, name=None, cache_size=256):
+        if msgpack is None:
+            raise ImportError('MsgpackCodec requires the msgpack package')
+        Codec.__init__(self, name, cache_size)
+
+    def encode(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class RawCodec(Codec):
+    """
+    Pass ``str`` and ``bytes`` messages through unchanged.
+    """
+    name = 'raw'
+
+    def encode(self, obj):
+        return obj
+
+    def encode_cached(self, obj):
+        return obj
+
+    def decode(self, data):
+        return data
+
+
+_CODECS = {}
+
+
+def register_codec(codec):
+    """
+    Make ``codec`` the codec for websockets that negotiate the subprotocol ``codec.name``.
+    """
+    _CODECS[codec.name] = codec
+
+
+def get_codec(subprotocol):
+    """
+    :return: The codec registered for ``subprotocol``, or a :class:`RawCodec` if there is none.
+    """
+    codec = _CODECS.get(subprotocol)
+    if codec is None:
+        codec = _CODECS['raw']
+    return codec
+
+
+register_codec(RawCodec())
+register_codec(JsonCodec())
+if msgpack is not None:
+    register_codec(MsgpackCodec())
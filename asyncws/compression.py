@@ -0,0 +1,170 @@
+import zlib
+import hashlib
+import argparse
+import collections
+
+from .exceptions import *
+
+__all__ = ['PresetDictionary', 'build_dictionary']
+
+
+class PresetDictionary:
+    """
+    Message compression with a zlib preset dictionary shared by both ends.
+
+    Small messages with repetitive structure compress poorly on their own, but well against a
+    dictionary of the strings they tend to contain. Each message is deflated independently
+    against ``zdict``, so no compression state is kept between messages and no sliding window
+    memory is held per connection.
+
+    Pass the same dictionary to :func:`start_server` and :func:`connect` with the ``compression``
+    keyword. The client offers the ``x-asyncws-zdict`` extension with the dictionary id, and the
+    server accepts it only if the id matches its own dictionary. Compressed messages are marked
+    with the RSV1 bit. Messages shorter than ``min_size``, or that do not get any smaller, are
+    sent uncompressed. See :func:`build_dictionary` to make a dictionary from sample messages.
+
+    :param zdict: Dictionary bytes, at most 32768 are used.
+    :param level: zlib compression level.
+    :param min_size: Shortest message worth compressing, in bytes.
+    """
+    extension = 'x-asyncws-zdict'
+
+    def __init__(self, zdict, level=6, min_size=32):
+        self.zdict = bytes(zdict[-32768:])
+        self.level = level
+        self.min_size = min_size
+        self.id = hashlib.sha1(self.zdict).hexdigest()[:16]
+
+
+    @classmethod
+    def load(cls, path, **kwds):
+        with open(path, 'rb') as file:
+            return cls(file.read(), **kwds)
+
+
+    def offer(self):
+        return '{0}; id={1}'.format(self.extension, self.id)
+
+
+    def accepts(self, name, params):
+        return name == self.extension and params.get('id') == self.id
+
+
+    def compress(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, 8, zlib.Z_DEFAULT_STRATEGY, self.zdict)
+        return compressor.compress(data) + compressor.flush()
+
+
+    def decompress(self, data, max_size):
+        decompressor = zlib.decompressobj(-15, self.zdict)
+        try:
+            payload = decompressor.decompress(data, max_size)
+        except zlib.error:
+            raise ClosedException(1002, 'invalid compressed payload')
+
+        if decompressor.unconsumed_tail:
+            raise ClosedException(1009, 'payload too large')
+        return payload
+
+
+def build_dictionary(samples, size=32768, gram=8):
+    """
+    Build a preset dictionary from sample messages.
+
+    Runs of bytes that recur across many samples are collected and ranked by how much they would
+    save, and the best are packed into the dictionary with the most valuable last, where zlib
+    reaches them with the shortest distances.
+
+    :param samples: Iterable of ``str`` or ``bytes`` messages.
+    :param size: Largest dictionary size, zlib uses at most 32768 bytes.
+    :param gram: Shortest run considered.
+    :return: Dictionary ``bytes`` for :class:`PresetDictionary`.
+    """
+    samples = [sample.encode('utf-8') if isinstance(sample, str) else bytes(sample) for sample in samples]
+    if not samples:
+        return b''
+
+    # in how many samples does each gram appear
+    frequency = collections.Counter()
+    for sample in samples:
+        frequency.update(set(sample[i:i + gram] for i in range(len(sample) - gram + 1)))
+
+    threshold = max(2, len(samples) // 100)
+    runs = collections.Counter()
+    for sample in samples:
+        start = None
+        end = 0
+        for i in range(len(sample) - gram + 1):
+            if frequency[sample[i:i + gram]] >= threshold:
+                if start is None or i > end:
+                    if start is not None:
+                        runs[sample[start:end]] += 1
+                    start = i
+                end = i + gram
+        if start is not None:
+            runs[sample[start:end]] += 1
+
+    ranked = sorted(runs.items(), key=lambda item: item[1] * len(item[0]), reverse=True)
+    chosen = []
+    total = 0
+    for run, _ in ranked:
+        if total + len(run) > size:
+            continue
+        if any(run in other for other in chosen):
+            continue
+        chosen.append(run)
+        total += len(run)
+
+    chosen.reverse()
+    return b''.join(chosen)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m asyncws.compression')
+    commands = parser.add_subparsers(dest='command')
+    build = commands.add_parser('build', help='build a preset dictionary from sample messages')
+    build.add_argument('output')
+    build.add_argument('samples', nargs='*', help='files with one sample message per line')
+    build.add_argument('--capture', action='append', default=[],
+                       help='capture log to take data messages from')
+    build.add_argument('--size', type=int, default=32768)
+    args = parser.parse_args(argv)
+
+    if args.command != 'build':
+        parser.print_help()
+        return
+
+    samples = []
+    for path in args.samples:
+        with open(path, 'rb') as file:
+            samples.extend(line.rstrip(b'\r\n') for line in file if line.strip())
+
+    if args.capture:
+        from .capture import read_capture, _unbatch, _RECEIVED, _SENT
+        from .protocol import _TEXT, _BINARY, _RSV1, _RSV2
+        for path in args.capture:
+            for record in read_capture(path):
+                # complete messages that were captured with their payload, compressed ones
+                # would only teach the dictionary deflate output
+                if record.kind in (_RECEIVED, _SENT) and record.opcode in (_TEXT, _BINARY) \
+                        and record.fin and record.payload and not record.rsv & _RSV1:
+                    if record.rsv & _RSV2:
+                        samples.extend(message.encode('utf-8') if isinstance(message, str) else message
+                                       for message in _unbatch(record) if message)
+                    else:
+                        samples.append(record.payload)
+
+    zdict = build_dictionary(samples, args.size)
+    with open(args.output, 'wb') as file:
+        file.write(zdict)
+
+    dictionary = PresetDictionary(zdict)
+    original = sum(len(sample) for sample in samples)
+    compressed = sum(len(dictionary.compress(sample)) for sample in samples)
+    print('%d samples, dictionary %d bytes, id %s' % (len(samples), len(zdict), dictionary.id))
+    if original:
+        print('samples compress to %.1f%% of %d bytes' % (100.0 * compressed / original, original))
+
+
+if __name__ == '__main__':
+    main()
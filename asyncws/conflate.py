@@ -0,0 +1,96 @@
+import asyncio
+import collections
+
+__all__ = ['ConflatingChannel']
+
+
+class ConflatingChannel:
+    """
+    Send only the latest value of each key to a websocket that can not keep up.
+
+    State feeds such as prices or presence only care about the newest update of every key.
+    Updates are held here until the transport has drained, and an update replaces the one still
+    pending for its key, keeping that key's place in line. A slow client receives the current
+    state as soon as it catches up instead of a backlog of stale updates, and no more than one
+    message per key is ever held for it::
+
+        channel = ConflatingChannel(websocket)
+        channel.send('EURUSD', '{"bid": 1.0842, "ask": 1.0844}')
+
+    :param websocket: :class:`Websocket` the updates are sent to.
+    """
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.sent = 0
+        self.replaced = 0
+        self._pending = collections.OrderedDict()
+        self._task = None
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+
+    @property
+    def pending(self):
+        """
+        Number of keys with an update waiting to be sent.
+        """
+        return len(self._pending)
+
+
+    def send(self, key, data):
+        """
+        Queue ``data`` as the latest value of ``key``, replacing the update still waiting for it.
+        Returns right away, updates are dropped once the websocket is closed.
+
+        :param key: Any hashable value.
+        :param data: ``str`` or ``bytes``, see :meth:`Websocket.send`.
+        """
+        if self.websocket._closed:
+            return
+
+        if key in self._pending:
+            self.replaced += 1
+        self._pending[key] = data
+
+        if self._task is None:
+            self._idle.clear()
+            self._task = asyncio.ensure_future(self._run())
+
+
+    def discard(self, key):
+        """
+        Forget the update waiting for ``key``, if any.
+        """
+        self._pending.pop(key, None)
+
+
+    @asyncio.coroutine
+    def flush(self):
+        """
+        Wait until every pending update has been sent.
+        """
+        yield from self._idle.wait()
+
+
+    def close(self):
+        """
+        Drop pending updates and stop sending.
+        """
+        self._pending.clear()
+        if self._task is not None:
+            self._task.cancel()
+
+
+    @asyncio.coroutine
+    def _run(self):
+        try:
+            while self._pending and not self.websocket._closed:
+                _, data = self._pending.popitem(last=False)
+                # wait for the transport to drain so that later updates can still be replaced here
+                yield from self.websocket.send(data, True)
+                self.sent += 1
+        except Exception:
+            self._pending.clear()
+        finally:
+            self._task = None
+            self._idle.set()
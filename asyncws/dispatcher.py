@@ -0,0 +1,104 @@
+import asyncio
+import collections
+
+__all__ = ['dispatch', 'dispatch_handler']
+
+
+@asyncio.coroutine
+def dispatch(websocket, func, key=None, max_concurrent=16):
+    """
+    Handle the messages of ``websocket`` concurrently, until it is closed.
+
+    :meth:`Websocket.recv` hands out messages one at a time, so a slow message holds up all that
+    follow it. Here every message gets its own task, up to ``max_concurrent`` at once, and messages
+    are only read while there is room, so a client can not pile up unlimited work. Messages that
+    ``key`` maps to the same value are handled one after the other in the order they arrived,
+    those without a key in any order::
+
+        @asyncio.coroutine
+        def handle(websocket, message):
+            request = json.loads(message)
+            ...
+
+        yield from dispatch(websocket, handle, key=lambda message: json.loads(message).get('session'))
+
+    When ``func`` or ``key`` raises, the websocket is closed with status 1011. Once the websocket
+    is closed, messages already read are still handled before :func:`dispatch` returns.
+
+    :param websocket: :class:`Websocket` to read from.
+    :param func: Coroutine function called with the websocket and each message.
+    :param key: Function returning the ordering key of a message, ``None`` for no ordering. \
+        Messages with a key of ``None`` are not ordered either.
+    :param max_concurrent: Most messages read and not yet handled, whether running or waiting \
+        behind another message with the same key.
+    """
+    slots = asyncio.Semaphore(max_concurrent)
+    waiting = {}
+    tasks = set()
+
+    @asyncio.coroutine
+    def run(ordering, message):
+        while True:
+            try:
+                yield from func(websocket, message)
+            except Exception as exp:
+                yield from websocket.close(1011, str(exp)[:100])
+            finally:
+                slots.release()
+
+            if ordering is None:
+                return
+            behind = waiting[ordering]
+            if not behind:
+                del waiting[ordering]
+                return
+            message = behind.popleft()
+
+    try:
+        while True:
+            yield from slots.acquire()
+            message = yield from websocket.recv()
+            if message is None:
+                slots.release()
+                break
+
+            ordering = None
+            if key is not None:
+                try:
+                    ordering = key(message)
+                    hash(ordering)
+                except Exception as exp:
+                    slots.release()
+                    yield from websocket.close(1011, str(exp)[:100])
+                    break
+
+            if ordering is not None:
+                if ordering in waiting:
+                    waiting[ordering].append(message)
+                    continue
+                waiting[ordering] = collections.deque()
+
+            task = asyncio.ensure_future(run(ordering, message))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            yield from asyncio.wait(list(tasks))
+
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+def dispatch_handler(func, key=None, max_concurrent=16):
+    """
+    Handler for :func:`start_server` that runs :func:`dispatch` on every client.
+
+    :return: Coroutine function to pass to :func:`start_server`.
+    """
+    @asyncio.coroutine
+    def handler(websocket):
+        yield from dispatch(websocket, func, key, max_concurrent)
+
+    return handler
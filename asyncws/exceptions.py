@@ -1,4 +1,4 @@
-__all__ = ['ClosedException', 'ProtocolError']
+__all__ = ['ClosedException', 'ProtocolError', 'HTTPError', 'RPCError']
 
 class ProtocolError(Exception):
     pass
@@ -13,4 +13,30 @@ class ClosedException(Exception):
         self.reason = reason
     
     def __str__(self):
-        return self.reason
\ No newline at end of file
+        return self.reason
+
+
+class HTTPError(Exception):
+
+    code = None
+    message = None
+
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class RPCError(Exception):
+
+    code = None
+    message = None
+
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+
+    def __str__(self):
+        return self.message
\ No newline at end of file
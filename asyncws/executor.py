@@ -0,0 +1,196 @@
+import asyncio
+
+__all__ = ['SyncWebsocket', 'threaded_handler', 'executor_handler']
+
+
+class SyncWebsocket:
+    """
+    Blocking interface to a :class:`Websocket` for code running in another thread.
+
+    Every call is handed to the event loop and waits for it to complete, so it must never be
+    used from the event loop's own thread. See :func:`threaded_handler`.
+
+    :param websocket: :class:`Websocket` to wrap.
+    :param loop: Event loop the websocket runs on.
+    """
+    def __init__(self, websocket, loop):
+        self.websocket = websocket
+        self.loop = loop
+
+    @property
+    def request(self):
+        return self.websocket.request
+
+    @property
+    def subprotocol(self):
+        return self.websocket.subprotocol
+
+    @property
+    def route_params(self):
+        return self.websocket.route_params
+
+    @property
+    def status(self):
+        return self.websocket.status
+
+    @property
+    def reason(self):
+        return self.websocket.reason
+
+    def _call(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def send(self, data, flush=False):
+        """
+        See :meth:`Websocket.send`.
+        """
+        self._call(self.websocket.send(data, flush))
+
+    def send_obj(self, obj, flush=False):
+        """
+        See :meth:`Websocket.send_obj`.
+        """
+        self._call(self.websocket.send_obj(obj, flush))
+
+    def recv(self, timeout=None):
+        """
+        See :meth:`Websocket.recv`.
+
+        :param timeout: Seconds to wait for a message.
+        :raises concurrent.futures.TimeoutError: When no message arrived in time.
+        """
+        future = asyncio.run_coroutine_threadsafe(self.websocket.recv(), self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def recv_obj(self, timeout=None):
+        """
+        See :meth:`Websocket.recv_obj`.
+        """
+        future = asyncio.run_coroutine_threadsafe(self.websocket.recv_obj(), self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def ping(self, data=b''):
+        self._call(self.websocket.ping(data))
+
+    def close(self, status=1000, reason=''):
+        """
+        See :meth:`Websocket.close`.
+        """
+        self._call(self.websocket.close(status, reason))
+
+
+def threaded_handler(func, executor=None, max_handlers=None):
+    """
+    Run a blocking handler in a thread for every client, for :func:`start_server`::
+
+        def echo(websocket):
+            while True:
+                frame = websocket.recv()
+                if frame is None:
+                    break
+                websocket.send(frame)
+
+        server = yield from start_server(threaded_handler(echo, max_handlers=32), '127.0.0.1', 8000)
+
+    Each handler holds a thread for as long as its client stays connected, so ``executor``
+    needs as many threads as clients are served at once. Clients beyond ``max_handlers`` wait
+    for a running handler to return before theirs is started.
+
+    :param func: Called with a :class:`SyncWebsocket` in a thread of ``executor``.
+    :param executor: `ThreadPoolExecutor \
+        <https://docs.python.org/3/library/concurrent.futures.html#threadpoolexecutor>`_, \
+        ``None`` for the event loop's default executor.
+    :param max_handlers: Most handlers running at once, ``None`` for no limit.
+    :return: Coroutine function to pass to :func:`start_server`.
+    """
+    slots = asyncio.Semaphore(max_handlers) if max_handlers else None
+
+    @asyncio.coroutine
+    def handler(websocket):
+        loop = asyncio.get_event_loop()
+        if slots is not None:
+            yield from slots.acquire()
+        try:
+            yield from loop.run_in_executor(executor, func, SyncWebsocket(websocket, loop))
+        finally:
+            if slots is not None:
+                slots.release()
+
+    return handler
+
+
+def executor_handler(func, executor=None, max_pending=None, pipeline=1):
+    """
+    Call a blocking or CPU heavy function in an executor for every message received, and send
+    back whatever it returns, for :func:`start_server`. With a `ProcessPoolExecutor \
+    <https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor>`_ the work
+    runs outside the interpreter lock, ``func`` then has to be a module level function::
+
+        def score(message):
+            return json.dumps(model.predict(json.loads(message)))
+
+        server = yield from start_server(executor_handler(score, ProcessPoolExecutor(), max_pending=64),
+                                         '127.0.0.1', 8000)
+
+    Results are sent in the order the messages arrived. Returning ``None`` sends nothing, ``str``
+    and ``bytes`` are sent as they are and anything else is encoded with the websocket's
+    :attr:`codec`. When ``func`` raises, the websocket is closed with status 1011.
+
+    :param func: Called with each message received.
+    :param executor: Executor the calls run in, ``None`` for the event loop's default executor.
+    :param max_pending: Most calls submitted at once over all clients, ``None`` for no limit. \
+        Clients whose messages would exceed it stop being read from until a call completes.
+    :param pipeline: Most calls submitted at once for a single client.
+    :return: Coroutine function to pass to :func:`start_server`.
+    """
+    slots = asyncio.Semaphore(max_pending) if max_pending else None
+
+    @asyncio.coroutine
+    def send_results(websocket, results, window):
+        while True:
+            future = yield from results.get()
+            try:
+                result = yield from future
+                if result is None:
+                    pass
+                elif isinstance(result, (str, bytes, bytearray)):
+                    yield from websocket.send(result)
+                else:
+                    yield from websocket.send_obj(result)
+            except Exception as exp:
+                yield from websocket.close(1011, str(exp)[:100])
+                return
+            finally:
+                window.release()
+
+    @asyncio.coroutine
+    def handler(websocket):
+        loop = asyncio.get_event_loop()
+        window = asyncio.Semaphore(pipeline)
+        results = asyncio.Queue()
+        sender = asyncio.ensure_future(send_results(websocket, results, window))
+        try:
+            while not sender.done():
+                message = yield from websocket.recv()
+                if message is None:
+                    break
+
+                yield from window.acquire()
+                if slots is not None:
+                    yield from slots.acquire()
+                future = loop.run_in_executor(executor, func, message)
+                if slots is not None:
+                    future.add_done_callback(lambda _: slots.release())
+                results.put_nowait(future)
+        finally:
+            sender.cancel()
+
+    return handler
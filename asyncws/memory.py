@@ -0,0 +1,212 @@
+import asyncio
+import collections
+import urllib.parse
+
+from .protocol import recv_entire_frame, handshake_with_client, handshake_with_server, \
+    _split_options, _create_websocket, _negotiated
+
+__all__ = ['websocket_pair']
+
+# bytes in flight before the writing side is asked to pause, and when it may resume
+_HIGH_WATER = 65536
+_LOW_WATER = 16384
+
+
+class _Link:
+    """
+    One direction of an in-memory connection, delivering written bytes to the peer protocol
+    in order, after ``latency`` seconds and no faster than ``bandwidth`` bytes per second.
+    """
+    def __init__(self, loop, latency, bandwidth, packet_size):
+        self._loop = loop
+        self._latency = latency
+        self._bandwidth = bandwidth
+        self._packet_size = packet_size
+        self._pending = collections.deque()
+        self._handle = None
+        self._free_at = 0.0
+        self.buffered = 0
+        self.sender = None
+        self.receiver = None
+
+    def send(self, data):
+        size = self._packet_size or len(data)
+        for start in range(0, len(data), size):
+            self._push(data[start:start + size])
+
+    def send_eof(self):
+        self._push(None)
+
+    def _push(self, packet):
+        at = self._loop.time()
+        if self._bandwidth and packet is not None:
+            self._free_at = max(at, self._free_at) + len(packet) / self._bandwidth
+            at = self._free_at
+        self._pending.append((at + self._latency, packet))
+        if packet is not None:
+            self.buffered += len(packet)
+            if self.buffered > _HIGH_WATER:
+                self.sender._pause()
+        if self._handle is None:
+            self._handle = self._loop.call_at(self._pending[0][0], self._deliver)
+
+    def _deliver(self):
+        self._handle = None
+        now = self._loop.time()
+        while self._pending and self._pending[0][0] <= now:
+            _, packet = self._pending.popleft()
+            if packet is not None:
+                self.buffered -= len(packet)
+            if self.receiver._lost:
+                continue
+            if packet is None:
+                self.receiver._protocol.eof_received()
+                self.receiver._connection_lost()
+            else:
+                self.receiver._protocol.data_received(packet)
+
+        if self.buffered <= _LOW_WATER:
+            self.sender._resume()
+        if self._pending:
+            self._handle = self._loop.call_at(self._pending[0][0], self._deliver)
+
+
+class _MemoryTransport(asyncio.Transport):
+
+    def __init__(self, loop, protocol, outgoing, name):
+        super().__init__({'peername': name, 'sockname': name})
+        self._loop = loop
+        self._protocol = protocol
+        self._outgoing = outgoing
+        self._closing = False
+        self._paused = False
+        self._lost = False
+
+    def write(self, data):
+        if self._closing:
+            return
+        self._outgoing.send(bytes(data))
+
+    def can_write_eof(self):
+        return True
+
+    def write_eof(self):
+        if not self._closing:
+            self._outgoing.send_eof()
+
+    def get_write_buffer_size(self):
+        return self._outgoing.buffered
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._outgoing.send_eof()
+        self._loop.call_soon(self._connection_lost)
+
+    def abort(self):
+        self.close()
+
+    def pause_reading(self):
+        pass
+
+    def resume_reading(self):
+        pass
+
+    def _pause(self):
+        if not self._paused and not self._closing:
+            self._paused = True
+            self._protocol.pause_writing()
+
+    def _resume(self):
+        if self._paused:
+            self._paused = False
+            self._protocol.resume_writing()
+
+    def _connection_lost(self):
+        if not self._lost:
+            self._lost = True
+            self._closing = True
+            self._protocol.connection_lost(None)
+
+
+def _memory_streams(loop, latency, bandwidth, packet_size):
+    to_server = _Link(loop, latency, bandwidth, packet_size)
+    to_client = _Link(loop, latency, bandwidth, packet_size)
+
+    streams = []
+    for outgoing, incoming, name in ((to_server, to_client, 'client'), (to_client, to_server, 'server')):
+        reader = asyncio.StreamReader()
+        protocol = asyncio.StreamReaderProtocol(reader)
+        transport = _MemoryTransport(loop, protocol, outgoing, name)
+        outgoing.sender = transport
+        incoming.receiver = transport
+        protocol.connection_made(transport)
+        streams.append((reader, asyncio.StreamWriter(transport, protocol, reader, loop)))
+    return streams
+
+
+@asyncio.coroutine
+def websocket_pair(resource='/', latency=0.0, bandwidth=None, packet_size=None, server_options=None, **kwds):
+    """
+    Create a connected client and server :class:`Websocket` over an in-memory transport.
+
+    Both ends go through the real opening handshake and framing, but no sockets are involved, so
+    tests and benchmarks are not disturbed by the kernel and run much faster. The connection can
+    be made to behave like a slower network::
+
+        client, server = yield from websocket_pair(latency=0.01, bandwidth=1000000, packet_size=1400)
+
+    Writers are paused while more than 64KiB are in flight in either direction, so sending with
+    ``flush`` waits for the link just like on a socket.
+
+    :param resource: Path the client asks for.
+    :param latency: Seconds each write takes to reach the other end.
+    :param bandwidth: Bytes per second in each direction, ``None`` for no limit.
+    :param packet_size: Writes are delivered in pieces of at most this many bytes, ``None`` to \
+        deliver them whole.
+    :param server_options: Websocket options for the server end only, such as ``subprotocols``.
+    :param kwds: Websocket options such as ``fragment_size``, ``compression``, ``capture`` or ``memory_budget`` \
+        applied to both ends.
+    :return: ``(client, server)`` websockets.
+    """
+    loop = asyncio.get_event_loop()
+    (client_reader, client_writer), (server_reader, server_writer) = \
+        _memory_streams(loop, latency, bandwidth, packet_size)
+
+    client_options = _split_options(kwds)
+    server_options = dict(server_options or {})
+    options = dict(client_options)
+    options.update(_split_options(server_options))
+    if kwds or server_options:
+        raise TypeError('unknown websocket options {0}'.format(', '.join(sorted(set(kwds) | set(server_options)))))
+
+    url = urllib.parse.urlparse('ws://memory' + resource)
+    accept = asyncio.ensure_future(handshake_with_client(server_reader, server_writer, **options))
+    try:
+        response = yield from handshake_with_server(client_reader, client_writer, url, **client_options)
+        request = yield from accept
+    except BaseException:
+        accept.cancel()
+        client_writer.close()
+        server_writer.close()
+        raise
+
+    client = _create_websocket(client_reader, client_writer, client_options)
+    client._frame_writer.mask = True
+    client.response = response
+    _negotiated(client, response, url.path, client_options)
+
+    server = _create_websocket(server_reader, server_writer, options)
+    server.request = request
+    server.route_params = request.route_params
+    _negotiated(server, request, request.path, options)
+
+    for websocket, websocket_options in ((client, client_options), (server, options)):
+        if websocket_options.get('tracer') is not None:
+            websocket_options['tracer'].attach(websocket)
+        websocket._recv_task = loop.create_task(recv_entire_frame(websocket, **websocket_options))
+    return client, server
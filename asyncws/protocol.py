@@ -1,18 +1,25 @@
 import sys
+import time
 import asyncio
 import base64
 import hashlib
 import codecs
 import struct
 import random
+import collections
 import urllib.parse
 from io import BytesIO
 from http.client import HTTPResponse
 from http.server import BaseHTTPRequestHandler
 
 from .exceptions import *
+from .codec import get_codec
+from .routing import Router
+from .budget import MemoryBudget
+from .tls import ClientSSLContext, configure_session_tickets, _default_ssl_context
 
-__all__ = ['Websocket', 'start_server', 'connect']
+__all__ = ['Websocket', 'FrameWriter', 'EncodedMessage', 'encode_message', 'start_server', 'connect',
+           'select_subprotocol', 'WSServer']
 
 _REQUEST = (
     'GET %(path)s HTTP/1.1\r\n'
@@ -21,14 +28,16 @@ _REQUEST = (
     'Host: %(host_port)s\r\n'
     'Origin: file://\r\n'
     'Sec-WebSocket-Key: %(key)s\r\n'
-    'Sec-WebSocket-Version: 13\r\n\r\n'
+    'Sec-WebSocket-Version: 13\r\n'
+    '%(headers)s\r\n'
 )
 
 _RESPONSE = (
     'HTTP/1.1 101 Switching Protocols\r\n'
     'Upgrade: websocket\r\n'
     'Connection: Upgrade\r\n'
-    'Sec-WebSocket-Accept: %(accept_string)s\r\n\r\n'
+    'Sec-WebSocket-Accept: %(accept_string)s\r\n'
+    '%(headers)s\r\n'
 )
 
 _GUID_STRING = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
@@ -40,8 +49,73 @@ _CLOSE = 0x8
 _PING = 0x9
 _PONG = 0xA
 
+_RSV1 = 0x40
+_RSV2 = 0x20
+
 _VALID_STATUS_CODES = [1000, 1001, 1002, 1003, 1007, 1008, 1009, 1010, 1011, 3000, 3999, 4000, 4999]
 
+# keyword arguments consumed by the websocket layer rather than asyncio
+_WEBSOCKET_OPTIONS = ('fragment_size', 'binary_sink', 'sink_threshold', 'capture', 'subprotocols',
+                      'tracer', 'compression', 'memory_budget', 'handshake_timeout', 'max_header', 'max_payload',
+                      'batching')
+
+
+def _split_options(kwds):
+    options = {}
+    for name in _WEBSOCKET_OPTIONS:
+        if name in kwds:
+            options[name] = kwds.pop(name)
+    if options.get('memory_budget') is not None and not isinstance(options['memory_budget'], MemoryBudget):
+        options['memory_budget'] = MemoryBudget(options['memory_budget'])
+    return options
+
+
+def _create_websocket(reader, writer, options):
+    return Websocket(reader, writer, options.get('fragment_size', 65536),
+                     options.get('binary_sink'), options.get('sink_threshold', 65536))
+
+
+def _negotiated(websocket, handshake, path, options):
+    # apply what the opening handshake agreed on, request or response alike
+    websocket.subprotocol = handshake.subprotocol
+    websocket.codec = get_codec(handshake.subprotocol)
+    websocket.compression = handshake.compression
+    websocket.batching = websocket._frame_writer.batching = handshake.batching
+    if options.get('capture') is not None:
+        options['capture'].attach(websocket, path)
+
+
+def _header_list(value):
+    if not value:
+        return []
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def _parse_extensions(value):
+    extensions = []
+    for item in _header_list(value):
+        name, _, rest = item.partition(';')
+        params = {}
+        for param in rest.split(';'):
+            key, _, param_value = param.partition('=')
+            if key.strip():
+                params[key.strip()] = param_value.strip().strip('"')
+        extensions.append((name.strip(), params))
+    return extensions
+
+
+def select_subprotocol(offered, supported):
+    """
+    Pick the first of the ``supported`` subprotocols, in order of preference, that the client ``offered``.
+
+    :return: The chosen subprotocol or ``None`` if there is none in common.
+    """
+    for subprotocol in supported:
+        if subprotocol in offered:
+            return subprotocol
+    return None
+
+
 class FakeSocket():
     def __init__(self, response_str):
         self._file = BytesIO(response_str)
@@ -62,6 +136,307 @@ class HTTPRequest(BaseHTTPRequestHandler):
         self.error_message = message
 
 
+class EncodedMessage:
+    """
+    A data message framed once so that it can be written to any number of server websockets
+    without being encoded again. See :func:`encode_message` and :meth:`Websocket.send_encoded`.
+
+    :param opcode: Frame opcode.
+    :param frame: Unmasked frame, header included.
+    :param offset: Length of the frame header.
+    """
+    __slots__ = ('opcode', 'frame', 'offset')
+
+    def __init__(self, opcode, frame, offset):
+        self.opcode = opcode
+        self.frame = frame
+        self.offset = offset
+
+    @property
+    def payload(self):
+        return memoryview(self.frame)[self.offset:]
+
+
+def encode_message(data, opcode=None):
+    """
+    Frame ``data`` once for :meth:`Websocket.send_encoded`.
+
+    :param data: If data is of type ``str`` then it becomes a text frame, otherwise a binary frame.
+    :param opcode: Frame opcode to use instead, e.g. for a close frame.
+    :return: :class:`EncodedMessage`
+    """
+    payload = data
+    if isinstance(data, str):
+        payload = data.encode('utf-8')
+    if opcode is None:
+        opcode = _TEXT if isinstance(data, str) else _BINARY
+
+    header = frame_header(False, opcode, len(payload))
+    return EncodedMessage(opcode, bytes(header) + payload, len(header))
+
+
+class FrameWriter:
+    """
+    Serializes the frames written to a websocket transport.
+
+    Data messages are written one at a time and split into fragments of at most
+    ``fragment_size`` bytes. Between fragments the writer waits for the transport
+    buffer to drain, while control frames (ping, pong and close) are written
+    immediately. A pong or close therefore never has to wait behind the rest of
+    a large message. RFC 6455 does not allow fragments of different data
+    messages to be interleaved, so concurrent senders take turns per message
+    in the order they called in.
+
+    :param writer: `StreamWriter. \
+        <https://docs.python.org/3.4/library/asyncio-stream.html#asyncio.StreamWriter>`_
+    :param mask: Mask outgoing frames, required for client websockets.
+    :param fragment_size: Largest payload written in a single frame.
+    """
+    def __init__(self, writer, mask=False, fragment_size=65536):
+        self.writer = writer
+        self.mask = mask
+        self.fragment_size = fragment_size
+        self.closed = False
+        self.capture = None
+        self.trace = None
+        self.batching = None
+        self._lock = asyncio.Lock()
+        self._batch = []
+        self._batch_size = 0
+        self._batch_handle = None
+        self._batch_waiting = False
+
+
+    def write_control(self, opcode, payload):
+        if self.closed:
+            return
+
+        if opcode == _CLOSE and self._batch and not self._lock.locked():
+            self._write_batch()
+        self._write(False, opcode, payload)
+        if opcode == _CLOSE:
+            self.closed = True
+
+
+    def write_encoded_control(self, message):
+        """
+        Write a control frame made in advance by :func:`encode_message`, e.g. the same close \
+        frame for many websockets. Only for websockets that do not mask their frames.
+        """
+        if self.closed:
+            return
+
+        if message.opcode == _CLOSE and self._batch and not self._lock.locked():
+            self._write_batch()
+        self._write_encoded(message)
+        if message.opcode == _CLOSE:
+            self.closed = True
+
+
+    @asyncio.coroutine
+    def send_control(self, opcode, payload, flush=False):
+        started = self._started(flush)
+        self.write_control(opcode, payload)
+        if flush:
+            yield from self._flush(started)
+
+
+    @asyncio.coroutine
+    def send_message(self, opcode, payload, flush=False, rsv=0):
+        started = self._started(flush)
+        if self.batching is not None and rsv == 0 and len(payload) < self.batching.max_message:
+            self._add_to_batch(opcode, payload)
+            if flush:
+                yield from self._flush_batch()
+        elif not self._lock.locked() and not self._batch and len(payload) <= self.fragment_size:
+            # nothing in flight and no need to fragment so write straight through
+            if not self.closed:
+                self._write(False, opcode, payload, rsv)
+        else:
+            yield from self._lock.acquire()
+            try:
+                # small messages sent before this one go out first
+                self._write_batch()
+                yield from self._write_fragments(opcode, payload, False, rsv)
+            finally:
+                self._lock.release()
+
+        if flush and not self.closed:
+            yield from self._flush(started)
+
+
+    def write_encoded(self, message):
+        """
+        Write an :class:`EncodedMessage` if that can be done without waiting.
+
+        :return: ``False`` if another message is in progress or frames have to be masked, \
+            in which case :meth:`send_encoded` has to be used.
+        """
+        if self.mask or self._lock.locked() or self._batch:
+            return False
+
+        self._write_encoded(message)
+        return True
+
+
+    @asyncio.coroutine
+    def send_encoded(self, message, flush=False):
+        if self.mask:
+            # client frames are masked individually so the framing can not be shared
+            yield from self.send_message(message.opcode, message.payload, flush)
+            return
+
+        started = self._started(flush)
+        if not self.write_encoded(message):
+            yield from self._lock.acquire()
+            try:
+                self._write_batch()
+                self._write_encoded(message)
+            finally:
+                self._lock.release()
+
+        if flush and not self.closed:
+            yield from self._flush(started)
+
+
+    @asyncio.coroutine
+    def send_stream_start(self, opcode, payload, flush=False):
+        started = self._started(flush)
+        yield from self._lock.acquire()
+        try:
+            self._write_batch()
+            yield from self._write_fragments(opcode, payload, True)
+        except BaseException:
+            self._lock.release()
+            raise
+
+        if flush and not self.closed:
+            yield from self._flush(started)
+
+
+    @asyncio.coroutine
+    def send_stream(self, payload, flush=False):
+        started = self._started(flush)
+        yield from self._write_fragments(_STREAM, payload, True)
+        if flush and not self.closed:
+            yield from self._flush(started)
+
+
+    @asyncio.coroutine
+    def send_stream_end(self, payload, flush=False):
+        started = self._started(flush)
+        try:
+            yield from self._write_fragments(_STREAM, payload, False)
+        finally:
+            if self._lock.locked():
+                self._lock.release()
+
+        if flush and not self.closed:
+            yield from self._flush(started)
+
+
+    def _write(self, fin, opcode, payload, rsv=0):
+        write_frame(self.writer, fin, opcode, payload, self.mask, rsv)
+        if self.capture is not None:
+            self.capture.record_sent(fin is False, opcode, payload, rsv)
+        if self.trace is not None:
+            self.trace.frame_sent(fin is False, opcode, len(payload))
+
+
+    def _write_encoded(self, message):
+        if self.closed:
+            return
+
+        self.writer.write(message.frame)
+        if self.capture is not None:
+            self.capture.record_sent(True, message.opcode, message.payload, 0)
+        if self.trace is not None:
+            self.trace.frame_sent(True, message.opcode, len(message.frame) - message.offset)
+
+
+    def _add_to_batch(self, opcode, payload):
+        if self.closed:
+            return
+
+        self._batch.append((opcode == _TEXT, bytes(payload)))
+        self._batch_size += len(payload)
+        if self._batch_size >= self.batching.max_size:
+            self._batch_due()
+        elif self._batch_handle is None:
+            self._batch_handle = asyncio.get_event_loop().call_later(self.batching.window, self._batch_due)
+
+
+    def _batch_due(self):
+        if not self._lock.locked():
+            self._write_batch()
+        elif not self._batch_waiting:
+            # wait for the message in progress to finish
+            self._batch_waiting = True
+            asyncio.ensure_future(self._flush_batch())
+
+
+    @asyncio.coroutine
+    def _flush_batch(self):
+        if not self._lock.locked():
+            self._write_batch()
+            return
+
+        yield from self._lock.acquire()
+        try:
+            self._batch_waiting = False
+            self._write_batch()
+        finally:
+            self._lock.release()
+
+
+    def _write_batch(self):
+        if self._batch_handle is not None:
+            self._batch_handle.cancel()
+            self._batch_handle = None
+        if not self._batch:
+            return
+
+        batch = self._batch
+        self._batch = []
+        self._batch_size = 0
+        if not self.closed:
+            self._write(False, _BINARY, self.batching.pack(batch), _RSV2)
+
+
+    def _started(self, flush):
+        if flush and self.trace is not None:
+            return time.monotonic()
+        return None
+
+
+    @asyncio.coroutine
+    def _flush(self, started):
+        yield from self.writer.drain()
+        if self.trace is not None and started is not None:
+            self.trace.drain_complete(started)
+
+
+    @asyncio.coroutine
+    def _write_fragments(self, opcode, payload, more, rsv=0):
+        length = len(payload)
+        size = self.fragment_size
+        view = memoryview(payload)
+        offset = 0
+        while not self.closed:
+            chunk = view[offset:offset + size]
+            offset += size
+            last = offset >= length
+            self._write(more or not last, opcode, chunk, rsv)
+            # extension bits only go on the first frame of a message
+            opcode = _STREAM
+            rsv = 0
+            if last or self.closed:
+                break
+            # let the transport catch up so control frames written
+            # in the meantime go out ahead of the remaining fragments
+            yield from self.writer.drain()
+
+
 class Websocket:
     """
     Class that wraps the websocket protocol.
@@ -75,24 +450,82 @@ class Websocket:
     :param response: HTTP response that arrives at the client after handshaking is complete. \
         See `HTTPResponse. <https://docs.python.org/3.4/library/http.client.html#http.client.HTTPResponse>`_ \
         Set to ``None`` if it's a server websocket.
+    :param fragment_size: Outgoing messages larger than this are split into fragments \
+        so that control frames are not held up behind them. See :class:`FrameWriter`.
+    :param binary_sink: Binary messages of at least ``sink_threshold`` bytes are written to this \
+        sink as they arrive instead of being assembled in memory, and :meth:`recv` returns \
+        whatever the sink hands back. See :class:`TemporaryFileSink`, :class:`FileSink` and \
+        :class:`MmapSink`. The attribute can be changed at any time and is consulted at the \
+        start of each message.
+    :param sink_threshold: Smallest binary message, in bytes, that goes to ``binary_sink``.
+    :param subprotocol: Subprotocol agreed during handshaking, ``None`` if there is none.
+    :param codec: :class:`Codec` used by :meth:`send_obj` and :meth:`recv_obj`, \
+        chosen from the subprotocol. See :func:`register_codec`.
+    :param route_params: Parameters extracted from the request path when the server uses a :class:`Router`.
+    :param trace: Set when the websocket is followed by a :class:`Tracer`, otherwise ``None``.
+    :param compression: :class:`PresetDictionary` agreed during handshaking, ``None`` if messages \
+        are not compressed.
+    :param batching: :class:`Batching` agreed during handshaking, ``None`` if small messages are \
+        not batched.
+    :param max_payload: Largest incoming message, in bytes, from the ``max_payload`` option. \
+        Binary sinks without a ``max_size`` of their own use it as well.
     """
-    def __init__(self, reader, writer):
+    def __init__(self, reader, writer, fragment_size=65536, binary_sink=None, sink_threshold=65536):
         self.writer = writer
         self._reader = reader
         self._queue = asyncio.Queue()
         self._recv_task = None
+        self._carry = None
+        self._frame_writer = FrameWriter(writer, False, fragment_size)
         self.response = None
         self.request = None
         self._closed = False
-        self._mask = False
         self.status = 1000
         self.reason = ''
+        self.binary_sink = binary_sink
+        self.sink_threshold = sink_threshold
+        self.capture = None
+        self.subprotocol = None
+        self.codec = get_codec(None)
+        self.route_params = {}
+        self.trace = None
+        self.compression = None
+        self.batching = None
+        self.max_payload = 33554432
+        self._abort = None
+        self._close_received = False
+        # (result, size) of binary sink messages still queued, in queue order
+        self._sink_sizes = collections.deque()
 
 
     def destroy(self):
         self.writer.close()
 
 
+    def abort(self, status=1011, reason=''):
+        """
+        Close the websocket right away. A close frame is sent but the endpoint's reply is not \
+            waited for, receiving stops and whatever was being received is discarded. \
+            :meth:`recv` returns ``None`` and :attr:`status` and :attr:`reason` are set to the values given.
+
+        :param status: See `Status Codes. <https://tools.ietf.org/html/rfc6455#section-7.4>`_
+        :param reason: Why the websocket is being closed.
+        """
+        if self._abort is not None:
+            return
+        self._abort = ClosedException(status, reason)
+        if self._closed is False:
+            self._closed = True
+            try:
+                self._frame_writer.write_control(_CLOSE, close_payload(status, reason))
+            except Exception:
+                pass
+        if self._recv_task is not None:
+            self._recv_task.cancel()
+        else:
+            self.writer.close()
+
+
     @asyncio.coroutine
     def wait_closed(self):
         if self._recv_task:
@@ -115,7 +548,7 @@ class Websocket:
         """
         if self._closed is False:
             self._closed = True
-            yield from send_close_frame(self.writer, status, reason, self._mask)
+            yield from self._frame_writer.send_control(_CLOSE, close_payload(status, reason), True)
 
 
     @asyncio.coroutine
@@ -134,7 +567,66 @@ class Websocket:
             opcode = _TEXT
             payload = data.encode('utf-8')
 
-        yield from send_frame(self.writer, False, opcode, payload, self._mask, flush)
+        compression = self.compression
+        if compression is not None and len(payload) >= compression.min_size:
+            compressed = compression.compress(payload)
+            if len(compressed) < len(payload):
+                yield from self._frame_writer.send_message(opcode, compressed, flush, _RSV1)
+                return
+
+        yield from self._frame_writer.send_message(opcode, payload, flush)
+
+
+    @asyncio.coroutine
+    def send_encoded(self, message, flush=False):
+        """
+        Send a message framed in advance by :func:`encode_message`. Server websockets write the \
+        shared frame as is, client websockets have to mask it and fall back to :meth:`send`.
+
+        :param message: :class:`EncodedMessage`
+        :param flush: When set to ``True`` then the send buffer is flushed immediately.
+        """
+        yield from self._frame_writer.send_encoded(message, flush)
+
+
+    def encode_obj(self, obj):
+        """
+        Encode and frame ``obj`` once with the websocket's :attr:`codec`, to send the same object
+        to many websockets::
+
+            message = websocket.encode_obj(state)
+            for client in clients:
+                yield from client.send_obj(message)
+
+        The result only suits websockets that use the same codec.
+
+        :param obj: Object to encode.
+        :return: :class:`EncodedMessage`
+        """
+        return encode_message(self.codec.encode(obj))
+
+
+    @asyncio.coroutine
+    def send_obj(self, obj, flush=False, cache=False):
+        """
+        Encode ``obj`` with the websocket's :attr:`codec` and send it.
+
+        :param obj: Object to encode, or an :class:`EncodedMessage` from :meth:`encode_obj` \
+            which is sent as it is.
+        :param flush: When set to ``True`` then the send buffer is flushed immediately.
+        :param cache: Reuse the encoding of ``obj`` if the same object was sent before, \
+            on this or any other websocket with the same codec. See :meth:`Codec.encode_cached`.
+        """
+        if isinstance(obj, EncodedMessage):
+            yield from self.send_encoded(obj, flush)
+            return
+
+        if cache:
+            data = self.codec.encode_cached(obj)
+        else:
+            data = self.codec.encode(obj)
+
+        yield from self.send(data, flush)
 
 
     @asyncio.coroutine
@@ -145,7 +637,7 @@ class Websocket:
             opcode = _TEXT
             payload = data.encode('utf-8')
 
-        yield from send_frame(self.writer, True, opcode, payload, self._mask, flush)
+        yield from self._frame_writer.send_stream_start(opcode, payload, flush)
 
 
     @asyncio.coroutine
@@ -154,7 +646,7 @@ class Websocket:
         if isinstance(data, str):
             payload = data.encode('utf-8')
 
-        yield from send_frame(self.writer, True, _STREAM, payload, self._mask, flush)
+        yield from self._frame_writer.send_stream(payload, flush)
 
 
     @asyncio.coroutine
@@ -163,7 +655,7 @@ class Websocket:
         if isinstance(data, str):
             payload = data.encode('utf-8')
 
-        yield from send_frame(self.writer, False, _STREAM, payload, self._mask, flush)
+        yield from self._frame_writer.send_stream_end(payload, flush)
 
 
     @asyncio.coroutine
@@ -172,7 +664,7 @@ class Websocket:
         if isinstance(data, str):
             payload = data.encode('utf-8')
 
-        yield from send_frame(self.writer, False, _PING, payload, self._mask, flush)
+        yield from self._frame_writer.send_control(_PING, payload, flush)
 
 
     @asyncio.coroutine
@@ -189,22 +681,220 @@ class Websocket:
         if self._closed is True:
             return None
 
-        item = yield from self._queue.get()
-        self._queue.task_done()
+        if self._carry is not None:
+            item, self._carry = self._carry, None
+        else:
+            item = yield from self._queue.get()
+            self._queue.task_done()
+
+        if item is not None:
+            if self.trace is not None:
+                self.trace.message_dequeued(item, self._message_size(item))
+            self._taken(item)
         return item
 
 
+    def _message_size(self, item):
+        sizes = self._sink_sizes
+        if sizes and sizes[0][0] is item:
+            # a file or path from a binary sink, sized by the bytes written to it
+            return sizes[0][1]
+        return len(item)
+
+
+    def _taken(self, item):
+        sizes = self._sink_sizes
+        if sizes and sizes[0][0] is item:
+            sizes.popleft()
+
+
+    @asyncio.coroutine
+    def recv_obj(self):
+        """
+        Receive a frame and decode it with the websocket's :attr:`codec`.
+
+        :return: Decoded object. Returns ``None`` if the connection is closed or there is an error.
+        """
+        data = yield from self.recv()
+        if data is None:
+            return None
+        return self.codec.decode(data)
+
+
+    @asyncio.coroutine
+    def recv_many(self, max_items=None, max_bytes=None):
+        """
+        Receive every frame that is already queued, waiting only if none are.
+
+        :param max_items: Return at most this many frames.
+        :param max_bytes: Stop once the payload lengths add up to this many bytes. Messages from \
+            a binary sink count the bytes written to the sink. At least one frame is always \
+            returned, even if it is larger.
+        :return: List of websocket text or data frames. \
+            Returns ``None`` if the connection is closed or there is an error.
+        """
+
+        if self._closed is True:
+            return None
+
+        if self._carry is not None:
+            item, self._carry = self._carry, None
+        else:
+            item = yield from self._queue.get()
+            self._queue.task_done()
+
+        if item is None:
+            return None
+
+        size = self._message_size(item)
+        self._taken(item)
+        trace = self.trace
+        if trace is not None:
+            trace.message_dequeued(item, size)
+
+        queue = self._queue
+        items = [item]
+        while not queue.empty():
+            if max_items is not None and len(items) >= max_items:
+                break
+
+            item = queue.get_nowait()
+            queue.task_done()
+            if item is None:
+                # leave the closed marker for the next call
+                self._carry = item
+                break
+
+            item_size = self._message_size(item)
+            size += item_size
+            if max_bytes is not None and size > max_bytes:
+                self._carry = item
+                break
+
+            items.append(item)
+            self._taken(item)
+            if trace is not None:
+                trace.message_dequeued(item, item_size)
+
+        return items
+
+
+    def batches(self, max_items=None, max_bytes=None):
+        """
+        Asynchronous iterator over :meth:`recv_many` batches that stops when the connection closes::
+
+            async for batch in websocket.batches(max_items=512):
+                process(batch)
+        """
+        return _BatchIterator(self, max_items, max_bytes)
+
+
+class _BatchIterator:
+    def __init__(self, websocket, max_items, max_bytes):
+        self._websocket = websocket
+        self._max_items = max_items
+        self._max_bytes = max_bytes
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        batch = yield from self._websocket.recv_many(self._max_items, self._max_bytes)
+        if batch is None:
+            raise StopAsyncIteration
+        return batch
+
+
 @asyncio.coroutine
 def recv_entire_frame(ws, **kwds):
     max_payload = kwds.get('max_payload', 33554432)
+    budget = kwds.get('memory_budget')
+    ws.max_payload = max_payload
+    _sink_target = None
     try:
         _frag_start = False
         _frag_type = _BINARY
         _frag_buffer = None
+        _frag_size = 0
         _frag_decoder = codecs.getincrementaldecoder('utf-8')()
+        _frag_compressed = False
+        _frag_text = False
+        allowed_rsv = _RSV1 if ws.compression is not None else 0
+        if ws.batching is not None:
+            allowed_rsv |= _RSV2
 
         while True:
-            fin, opcode, length, frame = yield from recv_frame(ws._reader, max_payload)
+            fin, opcode, length, mask, rsv = yield from recv_frame_header(ws._reader, allowed_rsv)
+
+            if rsv and opcode != _TEXT and opcode != _BINARY:
+                raise ClosedException(1002, 'RSV bit must be 0')
+
+            batched = rsv & _RSV2
+            if batched:
+                if not fin or opcode != _BINARY:
+                    raise ClosedException(1002, 'batches must be unfragmented binary frames')
+                rsv &= _RSV1
+
+            binary_data = (opcode == _BINARY and _frag_start is False and not rsv and not batched) or \
+                (opcode == _STREAM and _frag_start is True and _frag_type == _BINARY and not _frag_compressed)
+
+            if binary_data and _sink_target is None and ws.binary_sink is not None:
+                buffered = len(_frag_buffer) if _frag_start else 0
+                if buffered + length >= ws.sink_threshold:
+                    if _frag_size + length > max_payload:
+                        raise ClosedException(1009, 'payload too large')
+                    # the total size is only known up front for unfragmented messages
+                    total = length if fin and _frag_start is False else None
+                    _sink_target = ws.binary_sink.open(ws, total)
+                    if _sink_target is not None and buffered:
+                        _sink_target.write(_frag_buffer)
+                        _frag_buffer = bytearray()
+                        # the fragments are held by the sink from now on
+                        if budget is not None:
+                            budget.release(ws)
+
+            if binary_data and _sink_target is not None:
+                _frag_size += length
+                if _frag_size > max_payload:
+                    raise ClosedException(1009, 'payload too large')
+
+                yield from recv_payload_into(ws._reader, length, mask, _sink_target)
+                if ws.capture is not None:
+                    ws.capture.record_received(fin, opcode, length, None, rsv)
+                if ws.trace is not None:
+                    ws.trace.frame_received(fin, opcode, length)
+                if fin:
+                    target, _sink_target = _sink_target, None
+                    result = target.finish()
+                    ws._sink_sizes.append((result, _frag_size))
+                    ws._queue.put_nowait(result)
+                    if ws.trace is not None:
+                        ws.trace.message_enqueued(result, _frag_size)
+                    if budget is not None:
+                        budget.release(ws)
+
+                    _frag_start = False
+                    _frag_type = _BINARY
+                    _frag_buffer = None
+                    _frag_size = 0
+                else:
+                    _frag_start = True
+                    _frag_type = _BINARY
+                continue
+
+            if length > max_payload:
+                raise ClosedException(1009, 'payload too large')
+
+            if budget is not None and opcode < _CLOSE:
+                budget.reserve(ws, length)
+
+            frame = yield from recv_payload(ws._reader, length, mask)
+            if ws.capture is not None:
+                ws.capture.record_received(fin, opcode, length, frame, rsv | batched)
+            if ws.trace is not None:
+                ws.trace.frame_received(fin, opcode, length)
+
             if opcode == _CLOSE:
                 status = 1000
                 reason = b''
@@ -227,9 +917,30 @@ def recv_entire_frame(ws, **kwds):
                 else:
                     status = 1002
 
+                ws._close_received = True
                 yield from ws.close(status, reason)
                 raise ClosedException(status, reason)
 
+            if rsv and fin:
+                frame = ws.compression.decompress(frame, max_payload)
+            elif rsv:
+                # buffer the compressed fragments and inflate them once the message is complete
+                _frag_compressed = True
+                _frag_text = opcode == _TEXT
+                opcode = _BINARY
+
+            if batched:
+                if _frag_start is True:
+                    raise ClosedException(1002, 'fragmentation protocol error')
+
+                for item in ws.batching.unpack(frame):
+                    ws._queue.put_nowait(item)
+                    if ws.trace is not None:
+                        ws.trace.message_enqueued(item)
+                if budget is not None:
+                    budget.release(ws)
+                continue
+
             if fin == 0:
                 # fragmentation start
                 if opcode != _STREAM:
@@ -239,6 +950,7 @@ def recv_entire_frame(ws, **kwds):
                     _frag_type = opcode
                     _frag_start = True
                     _frag_decoder.reset()
+                    _frag_size = length
 
                     if _frag_type == _TEXT:
                         _frag_buffer = []
@@ -249,28 +961,33 @@ def recv_entire_frame(ws, **kwds):
                         _frag_buffer = bytearray()
                         _frag_buffer.extend(frame)
 
-                    if len(_frag_buffer) > max_payload:
+                    if _frag_size > max_payload:
                         raise ClosedException(1009, 'payload too large')
                 else:
                     # got a fragment packet without a start
                     if _frag_start is False:
                         raise ClosedException(1002, 'fragmentation protocol error')
 
+                    _frag_size += length
+                    if _frag_size > max_payload:
+                        raise ClosedException(1009, 'payload too large')
+
                     if _frag_type == _TEXT:
                         utf_str = _frag_decoder.decode(frame, final=False)
                         if utf_str:
                             _frag_buffer.append(utf_str)
                     else:
                         _frag_buffer.extend(frame)
-
-                    if len(_frag_buffer) > max_payload:
-                        raise ClosedException(1009, 'payload too large')
             else:
 
                 if opcode == _STREAM:
                     if _frag_start is False:
                         raise ClosedException(1002, 'fragmentation protocol error')
 
+                    _frag_size += length
+                    if _frag_size > max_payload:
+                        raise ClosedException(1009, 'payload too large')
+
                     if _frag_type == _TEXT:
                         utf_str = _frag_decoder.decode(frame, final=True)
                         _frag_buffer.append(utf_str)
@@ -279,18 +996,29 @@ def recv_entire_frame(ws, **kwds):
                         _frag_buffer.extend(frame)
                         _frag_buffer = bytes(_frag_buffer)
 
-                    if len(_frag_buffer) > max_payload:
-                        raise ClosedException(1009, 'payload too large')
+                    if _frag_compressed:
+                        _frag_buffer = ws.compression.decompress(_frag_buffer, max_payload)
+                        if _frag_text:
+                            try:
+                                _frag_buffer = _frag_buffer.decode('utf-8')
+                            except Exception as exp:
+                                raise ClosedException(1002, 'invalid utf-8 payload')
 
                     ws._queue.put_nowait(_frag_buffer)
+                    if ws.trace is not None:
+                        ws.trace.message_enqueued(_frag_buffer)
+                    if budget is not None:
+                        budget.release(ws)
 
                     _frag_start = False
                     _frag_type = _BINARY
                     _frag_buffer = None
                     _frag_decoder.reset()
+                    _frag_compressed = False
+                    _frag_size = 0
 
                 elif opcode == _PING:
-                    yield from send_frame(ws.writer, False, _PONG, frame)
+                    ws._frame_writer.write_control(_PONG, frame)
 
                 elif opcode == _PONG:
                     continue
@@ -306,6 +1034,10 @@ def recv_entire_frame(ws, **kwds):
                             raise ClosedException(1002, 'invalid utf-8 payload')
 
                     ws._queue.put_nowait(frame)
+                    if ws.trace is not None:
+                        ws.trace.message_enqueued(frame)
+                    if budget is not None:
+                        budget.release(ws)
 
                     _frag_start = False
                     _frag_type = _BINARY
@@ -313,6 +1045,14 @@ def recv_entire_frame(ws, **kwds):
                     _frag_decoder.reset()
 
     except BaseException as exp:
+        if ws._abort is not None:
+            exp = ws._abort
+        if budget is not None:
+            budget.release(ws)
+        if _sink_target is not None:
+            _sink_target.abort()
+        if ws.capture is not None:
+            ws.capture.record_closed()
         ws.writer.close()
         status = 1002
         if isinstance(exp, ClosedException):
@@ -331,8 +1071,15 @@ def connect(wsurl, **kwds):
     """
     Connect to a websocket server. Connect will automatically carry out a websocket handshake.
 
-    :param wsurl: Websocket uri. See `RFC6455 URIs. <https://tools.ietf.org/html/rfc6455#section-3>`_
-    :param kwds: See `open_connection. \
+    :param wsurl: Websocket uri. See `RFC6455 URIs. <https://tools.ietf.org/html/rfc6455#section-3>`_ \
+        Servers listening on a Unix domain socket are reached with ``ws+unix:///path/to/socket``, \
+        optionally followed by ``:/resource?query``.
+    :param ssl: SSL context for ``wss://`` uris. Defaults to a shared :class:`ClientSSLContext` \
+        which verifies the server against the system's trusted certificates and resumes TLS sessions \
+        when reconnecting.
+    :param subprotocols: Subprotocols to offer the server, in order of preference.
+    :param kwds: Websocket options such as ``fragment_size``, ``binary_sink`` or ``capture`` \
+        are applied to the :class:`Websocket`, the rest are passed to `open_connection. \
         <https://docs.python.org/3.4/library/asyncio-stream.html#asyncio.open_connection>`_
     :return: :class:`Websocket` object on success.
     :raises Exception: When there is an error during connection or handshake.
@@ -343,17 +1090,34 @@ def connect(wsurl, **kwds):
         port = 80
         if url.port:
             port = url.port
-        if url.scheme.startswith('wss://'):
-            if not url.port:
-                port = 443
-
-        reader, writer = yield from asyncio.open_connection(host=url.hostname, port=port, **kwds)
-        response = yield from handshake_with_server(reader, writer, url, **kwds)
-        websocket = Websocket(reader, writer)
-        websocket._mask = True
-        websocket.reponse = response
+        elif url.scheme == 'wss':
+            port = 443
+        if url.scheme == 'wss' and kwds.get('ssl') in (None, True):
+            kwds['ssl'] = _default_ssl_context()
+
+        options = _split_options(kwds)
+        started = time.monotonic()
+        if url.scheme == 'ws+unix':
+            # ws+unix:///path/to/socket:/resource?query
+            socket_path, _, resource = url.path.partition(':')
+            url = url._replace(netloc='localhost', path=resource or '/')
+            reader, writer = yield from asyncio.open_unix_connection(socket_path, **kwds)
+        else:
+            reader, writer = yield from asyncio.open_connection(host=url.hostname, port=port, **kwds)
+        response = yield from handshake_with_server(reader, writer, url, **options)
+        # session tickets arrive after the TLS handshake, by now they have been read
+        if isinstance(kwds.get('ssl'), ClientSSLContext):
+            kwds['ssl'].remember(writer.get_extra_info('ssl_object'))
+        websocket = _create_websocket(reader, writer, options)
+        websocket._frame_writer.mask = True
+        websocket.response = response
+        _negotiated(websocket, response, url.path or '/', options)
+        if options.get('tracer') is not None:
+            trace = options['tracer'].attach(websocket)
+            trace.handshake_start(started)
+            trace.handshake_end()
         websocket._recv_task = asyncio.get_event_loop().create_task(
-            recv_entire_frame(websocket, **kwds))
+            recv_entire_frame(websocket, **options))
         return websocket
     except BaseException as exp:
         if writer:
@@ -362,10 +1126,78 @@ def connect(wsurl, **kwds):
 
 
 class WSServer(object):
+    """
+    Server returned by :func:`start_server`.
 
-    def __init__(self):
+    Admission is tracked live in :attr:`handshakes` and :attr:`connections` in progress, \
+        :attr:`waiting` for a free slot, and the totals :attr:`accepted` and :attr:`rejected`.
+    """
+    def __init__(self, max_handshakes=None, max_connections=None, when_full='reject'):
+        if when_full not in ('reject', 'pause'):
+            raise ValueError('when_full must be reject or pause')
         self._server = None
         self._tasks = {}
+        self._waiters = collections.deque()
+        self.memory_budget = None
+        self.max_handshakes = max_handshakes
+        self.max_connections = max_connections
+        self.when_full = when_full
+        self.handshakes = 0
+        self.connections = 0
+        self.waiting = 0
+        self.accepted = 0
+        self.rejected = 0
+        self._draining = False
+        self._drain_status = (1001, '')
+
+    def _full(self):
+        if self.max_handshakes is not None and self.handshakes >= self.max_handshakes:
+            return True
+        return self.max_connections is not None and self.connections >= self.max_connections
+
+    @asyncio.coroutine
+    def _admit(self):
+        if self._draining:
+            return False
+
+        while self._full():
+            if self.when_full == 'reject':
+                return False
+
+            waiter = asyncio.Future()
+            self._waiters.append(waiter)
+            self.waiting += 1
+            try:
+                yield from waiter
+            except asyncio.CancelledError:
+                # woken up just as the wait timed out, hand the slot to the next in line
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+            finally:
+                self.waiting -= 1
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+        self.handshakes += 1
+        self.connections += 1
+        self.accepted += 1
+        return True
+
+    def _handshake_done(self):
+        self.handshakes -= 1
+        self._wake()
+
+    def _connection_done(self):
+        self.connections -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
 
     def add_task(self, task, value):
         self._tasks[task] = value
@@ -387,6 +1219,46 @@ class WSServer(object):
         for task in self._tasks:
             task.cancel()
 
+    @asyncio.coroutine
+    def drain(self, timeout=10, status=1001, reason=''):
+        """
+        Stop accepting clients and close every websocket gracefully.
+
+        One close frame is encoded up front and written to all websockets at once, then the
+        endpoints' replies are awaited in parallel. Websockets that have not completed the close
+        handshake within ``timeout`` are torn down. Clients still in their opening handshake are
+        sent the same close frame once it completes. Handlers see :meth:`Websocket.recv` return
+        ``None`` as usual, call :meth:`close` and :meth:`wait_closed` afterwards to stop them.
+
+        :param timeout: Seconds to wait for the endpoints to reply.
+        :param status: Close status sent, 1001 going away by default.
+        :param reason: Close reason sent.
+        :return: Number of websockets whose endpoint replied with a close frame, and number \
+            that were torn down or lost their connection instead.
+        """
+        self._draining = True
+        self._drain_status = (status, reason)
+        self._server.close()
+
+        frame = encode_message(close_payload(status, reason), _CLOSE)
+        websockets = []
+        for websocket in set(self._tasks.values()):
+            if websocket._recv_task is None or websocket._recv_task.done():
+                continue
+            if websocket._closed is False:
+                websocket._closed = True
+                websocket._frame_writer.write_encoded_control(frame)
+            websockets.append(websocket)
+
+        if not websockets:
+            return 0, 0
+
+        _, pending = yield from asyncio.wait([websocket._recv_task for websocket in websockets], timeout=timeout)
+        for task in pending:
+            task.cancel()
+        clean = sum(1 for websocket in websockets if websocket._close_received)
+        return clean, len(websockets) - clean
+
     @asyncio.coroutine
     def wait_closed(self):
         yield from self._server.wait_closed()
@@ -397,38 +1269,106 @@ class WSServer(object):
 
 
 @asyncio.coroutine
-def start_server(func, host=None, port=None, **kwds):
+def start_server(func, host=None, port=None, path=None, max_handshakes=None, max_connections=None,
+                 when_full='reject', **kwds):
     """
     Start a websocket server, with a callback for each client connected.
 
-    :param func: Called with a :class:`Websocket` parameter when a client connects and handshake is successful.
-    :param kwds: See `start_server <https://docs.python.org/3.4/library/asyncio-stream.html#asyncio.start_server>`_
-    :return: The return value is the same as `start_server \
-    <https://docs.python.org/3.4/library/asyncio-stream.html#asyncio.start_server>`_
+    :param func: Called with a :class:`Websocket` parameter when a client connects and handshake is successful. \
+        Can also be a :class:`Router` or a dictionary of routes, in which case the handler is chosen by \
+        the request path and clients asking for an unknown path are refused with ``404 Not Found``.
+    :param path: Listen on a Unix domain socket at this path instead of ``host`` and ``port``. \
+        See `start_unix_server <https://docs.python.org/3.4/library/asyncio-stream.html#asyncio.start_unix_server>`_
+    :param subprotocols: Subprotocols the server supports, in order of preference. \
+        See :func:`select_subprotocol`.
+    :param max_handshakes: Most opening handshakes in progress at once, ``None`` for no limit.
+    :param max_connections: Most clients connected at once, handshakes included, ``None`` for no limit.
+    :param when_full: What happens to a client arriving while either limit is reached. With ``'reject'`` \
+        it is refused right away with ``503 Service Unavailable``, with ``'pause'`` its request is not \
+        read until a slot frees up, and it is refused if that takes longer than ``handshake_timeout``.
+    :param handshake_timeout: Seconds a client has to complete the opening handshake.
+    :param max_header: Largest handshake request, in bytes.
+    :param max_payload: Largest incoming message, in bytes.
+    :param session_tickets: Number of TLS session tickets issued to each client so it can resume \
+        its session when reconnecting, ``0`` to not allow resumption. Applied to the ``ssl`` context. \
+        See :func:`configure_session_tickets`.
+    :param memory_budget: Bytes of partially received messages all clients may hold together, \
+        or a :class:`MemoryBudget`. Messages are closed with status 1009 to stay within it.
+    :param kwds: Websocket options such as ``fragment_size``, ``binary_sink`` or ``capture`` \
+        are applied to each :class:`Websocket`, the rest are passed to \
+        `start_server <https://docs.python.org/3.4/library/asyncio-stream.html#asyncio.start_server>`_
+    :return: :class:`WSServer`
     """
-    ws_server = WSServer()
-    server = yield from asyncio.start_server(
-        lambda r, w: handle_server_websocket(r, w, ws_server, func), host, port, **kwds)
+    ws_server = WSServer(max_handshakes, max_connections, when_full)
+    session_tickets = kwds.pop('session_tickets', None)
+    if session_tickets is not None and kwds.get('ssl') is not None:
+        configure_session_tickets(kwds['ssl'], session_tickets)
+    options = _split_options(kwds)
+    if isinstance(func, dict):
+        func = Router(func)
+    if isinstance(func, Router):
+        options['router'] = func
+    ws_server.memory_budget = options.get('memory_budget')
+    if path is not None:
+        server = yield from asyncio.start_unix_server(
+            lambda r, w: handle_server_websocket(r, w, ws_server, func, **options), path, **kwds)
+    else:
+        server = yield from asyncio.start_server(
+            lambda r, w: handle_server_websocket(r, w, ws_server, func, **options), host, port, **kwds)
     ws_server.server = server
     return ws_server
 
 
 @asyncio.coroutine
 def handle_server_websocket(reader, writer, server, func, **kwds):
+    handshake_timeout = kwds.get('handshake_timeout', 12)
     try:
-        websocket = Websocket(reader, writer)
-        handshake_timeout = kwds.get('handshake_timeout', 12)
+        admitted = yield from asyncio.wait_for(server._admit(), timeout=handshake_timeout)
+    except asyncio.TimeoutError:
+        admitted = False
+
+    if not admitted:
+        server.rejected += 1
+        writer.write(b'HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\n\r\n')
+        writer.close()
+        return
+
+    try:
+        websocket = _create_websocket(reader, writer, kwds)
+        router = kwds.get('router')
+        if kwds.get('tracer') is not None:
+            kwds['tracer'].attach(websocket).handshake_start()
         try:
             request = yield from asyncio.wait_for(
                 handshake_with_client(reader, writer, **kwds), timeout=handshake_timeout)
+            if websocket.trace is not None:
+                websocket.trace.handshake_end()
             websocket.request = request
+            websocket.route_params = request.route_params
+            _negotiated(websocket, request, request.path, kwds)
         except BaseException as e:
             websocket._closed = True
+            if websocket.trace is not None:
+                websocket.trace.handshake_end(e)
+            # without a route there is no handler to tell about the failure
+            if router is not None:
+                return
+        finally:
+            server._handshake_done()
+
+        if server._draining:
+            # the drain started during the handshake and did not see this websocket
+            yield from websocket.close(*server._drain_status)
+            return
+
+        if router is not None:
+            func = request.handler
 
         def task_done(task):
             server.remove_task(task)
 
         recv_task = asyncio.ensure_future(recv_entire_frame(websocket, **kwds))
+        websocket._recv_task = recv_task
         server.add_task(recv_task, websocket)
         recv_task.add_done_callback(task_done)
 
@@ -441,6 +1381,7 @@ def handle_server_websocket(reader, writer, server, func, **kwds):
     except BaseException:
         pass
     finally:
+        server._connection_done()
         writer.close()
 
 
@@ -455,7 +1396,23 @@ def handshake_with_server(reader, writer, parsed_url, **kwds):
         if parsed_url.query:
             values = '?{0}'.format(parsed_url.query)
 
-        handshake = _REQUEST % {'path': parsed_url.path + values, 'host_port': parsed_url.netloc, 'key': key}
+        headers = ''
+        subprotocols = kwds.get('subprotocols')
+        if subprotocols:
+            headers += 'Sec-WebSocket-Protocol: {0}\r\n'.format(', '.join(subprotocols))
+
+        offers = []
+        compression = kwds.get('compression')
+        if compression is not None:
+            offers.append(compression.offer())
+        batching = kwds.get('batching')
+        if batching is not None:
+            offers.append(batching.offer())
+        if offers:
+            headers += 'Sec-WebSocket-Extensions: {0}\r\n'.format(', '.join(offers))
+
+        handshake = _REQUEST % {'path': parsed_url.path + values, 'host_port': parsed_url.netloc,
+                                'key': key, 'headers': headers}
 
         writer.write(handshake.encode('utf-8'))
         yield from writer.drain()
@@ -476,14 +1433,32 @@ def handshake_with_server(reader, writer, parsed_url, **kwds):
         response = HTTPResponse(FakeSocket(header_buffer))
         response.begin()
 
+        if response.status != 101:
+            raise ProtocolError('handshake refused: {0} {1}'.format(response.status, response.reason))
+
         accept_key = response.getheader('sec-websocket-accept')
-        if key is None:
+        if accept_key is None:
             raise ProtocolError('Sec-WebSocket-Accept does not exist')
 
         digested_key = base64.b64encode(hashlib.sha1((key + _GUID_STRING).encode('utf-8')).digest())
         if accept_key.encode() != digested_key:
             raise ProtocolError('Sec-WebSocket-Accept key does not match')
 
+        subprotocol = response.getheader('sec-websocket-protocol')
+        if subprotocol is not None and subprotocol not in (subprotocols or ()):
+            raise ProtocolError('server selected a subprotocol that was not offered')
+        response.subprotocol = subprotocol
+
+        response.compression = None
+        response.batching = None
+        for name, params in _parse_extensions(response.getheader('sec-websocket-extensions')):
+            if compression is not None and compression.accepts(name, params):
+                response.compression = compression
+            elif batching is not None and batching.accepts(name, params):
+                response.batching = batching
+            else:
+                raise ProtocolError('server selected an extension that was not offered')
+
         return response
 
     except asyncio.CancelledError:
@@ -512,8 +1487,39 @@ def handshake_with_client(reader, writer, **kwds):
         if key is None:
             raise ClosedException(1002, 'Sec-WebSocket-Key does not exist')
 
+        request.handler = None
+        request.route_params = {}
+        router = kwds.get('router')
+        if router is not None:
+            route = router.match(request.path)
+            if route is None:
+                raise HTTPError(404, 'Not Found')
+            request.handler, request.route_params = route
+
+        headers = ''
+        request.subprotocol = select_subprotocol(
+            _header_list(request.headers.get('sec-websocket-protocol')), kwds.get('subprotocols') or ())
+        if request.subprotocol is not None:
+            headers += 'Sec-WebSocket-Protocol: {0}\r\n'.format(request.subprotocol)
+
+        extensions = []
+        request.compression = None
+        request.batching = None
+        compression = kwds.get('compression')
+        batching = kwds.get('batching')
+        for name, params in _parse_extensions(request.headers.get('sec-websocket-extensions')):
+            if compression is not None and request.compression is None and compression.accepts(name, params):
+                request.compression = compression
+                extensions.append(compression.offer())
+            elif batching is not None and request.batching is None and batching.accepts(name, params):
+                request.batching = batching
+                extensions.append(batching.offer())
+
+        if extensions:
+            headers += 'Sec-WebSocket-Extensions: {0}\r\n'.format(', '.join(extensions))
+
         digest = base64.b64encode(hashlib.sha1((key + _GUID_STRING).encode('utf-8')).digest())
-        handshake = _RESPONSE % {'accept_string': digest.decode('utf-8')}
+        handshake = _RESPONSE % {'accept_string': digest.decode('utf-8'), 'headers': headers}
         writer.write(handshake.encode('utf-8'))
         yield from writer.drain()
         return request
@@ -523,6 +1529,12 @@ def handshake_with_client(reader, writer, **kwds):
         writer.write(response.encode('utf-8'))
         writer.close()
 
+    except HTTPError as exp:
+        response = 'HTTP/1.1 {0} {1}\r\n\r\n'.format(exp.code, exp.message)
+        writer.write(response.encode('utf-8'))
+        writer.close()
+        raise exp
+
     except BaseException as exp:
         response = 'HTTP/1.1 400 Bad Request\r\n\r\n{0}'.format(str(exp))
         writer.write(response.encode('utf-8'))
@@ -534,16 +1546,19 @@ def handshake_with_client(reader, writer, **kwds):
         raise exp
 
 
-@asyncio.coroutine
-def send_close_frame(writer, status=1000, reason='', mask=False):
+def close_payload(status=1000, reason=''):
     close_msg = bytearray()
     close_msg.extend(struct.pack('!H', status))
     if isinstance(reason, str):
         close_msg.extend(reason.encode('utf-8'))
     else:
         close_msg.extend(reason)
+    return close_msg
 
-    yield from send_frame(writer, False, _CLOSE, close_msg, mask, True)
+
+@asyncio.coroutine
+def send_close_frame(writer, status=1000, reason='', mask=False):
+    yield from send_frame(writer, False, _CLOSE, close_payload(status, reason), mask, True)
 
 
 native_byteorder = sys.byteorder
@@ -554,10 +1569,9 @@ def mask_data(mask, data):
     return (data ^ mask).to_bytes(datalen, native_byteorder)
 
 
-@asyncio.coroutine
-def send_frame(writer, fin, opcode, data, mask=False, flush=False):
+def frame_header(fin, opcode, length, mask=False, rsv=0):
     header = bytearray()
-    b1 = 0
+    b1 = rsv
     b2 = 0
 
     if fin is False:
@@ -569,7 +1583,6 @@ def send_frame(writer, fin, opcode, data, mask=False, flush=False):
     if mask:
         b2 |= 0x80
 
-    length = len(data)
     if length <= 125:
         b2 |= length
         header.append(b2)
@@ -582,7 +1595,12 @@ def send_frame(writer, fin, opcode, data, mask=False, flush=False):
         header.append(b2)
         header.extend(struct.pack('!Q', length))
 
-    writer.write(header)
+    return header
+
+
+def write_frame(writer, fin, opcode, data, mask=False, rsv=0):
+    length = len(data)
+    writer.write(frame_header(fin, opcode, length, mask, rsv))
 
     if mask:
         mask_bits = struct.pack('!I', random.getrandbits(32))
@@ -592,12 +1610,17 @@ def send_frame(writer, fin, opcode, data, mask=False, flush=False):
     if length > 0:
         writer.write(data)
 
+
+@asyncio.coroutine
+def send_frame(writer, fin, opcode, data, mask=False, flush=False):
+    write_frame(writer, fin, opcode, data, mask)
+
     if flush:
         yield from writer.drain()
 
 
 @asyncio.coroutine
-def recv_frame(reader, max_payload):
+def recv_frame_header(reader, allowed_rsv=0):
 
     h1, h2 = yield from reader.readexactly(2)
 
@@ -607,8 +1630,8 @@ def recv_frame(reader, max_payload):
     mask = h2 & 0x80
     length = h2 & 0x7F
 
-    # rsv must be 0 if not then close immediately
-    if rsv != 0:
+    # rsv must be 0 unless an extension claimed it, if not then close immediately
+    if rsv & ~allowed_rsv:
         raise ClosedException(1002, 'RSV bit must be 0')
 
     if opcode == _CLOSE:
@@ -640,14 +1663,16 @@ def recv_frame(reader, max_payload):
     else:
         raise ClosedException(1002, 'unknown payload length')
 
-    if length > max_payload:
-        raise ClosedException(1009, 'payload too large')
-
     if mask == 128:
         mask = yield from reader.readexactly(4)
     else:
         mask = None
 
+    return bool(fin), opcode, length, mask, rsv
+
+
+@asyncio.coroutine
+def recv_payload(reader, length, mask):
     payload = b''
     if length > 0:
         payload = yield from reader.readexactly(length)
@@ -655,4 +1680,29 @@ def recv_frame(reader, max_payload):
             mask_payload = mask_data(mask, payload)
             payload = mask_payload
 
-    return bool(fin), opcode, length, payload
+    return payload
+
+
+@asyncio.coroutine
+def recv_payload_into(reader, length, mask, target, chunk_size=65536):
+    # chunk_size is a multiple of 4 so every chunk starts on a mask boundary
+    remaining = length
+    while remaining > 0:
+        chunk = yield from reader.readexactly(min(chunk_size, remaining))
+        if mask:
+            chunk = mask_data(mask, chunk)
+        target.write(chunk)
+        remaining -= len(chunk)
+
+
+@asyncio.coroutine
+def recv_frame(reader, max_payload):
+
+    fin, opcode, length, mask, rsv = yield from recv_frame_header(reader)
+
+    if length > max_payload:
+        raise ClosedException(1009, 'payload too large')
+
+    payload = yield from recv_payload(reader, length, mask)
+
+    return fin, opcode, length, payload
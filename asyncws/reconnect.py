@@ -0,0 +1,179 @@
+import random
+import asyncio
+import collections
+
+from .protocol import connect
+from .exceptions import *
+from .tracing import LatencyStats
+
+__all__ = ['ReconnectingWebsocket']
+
+
+class ReconnectingWebsocket:
+    """
+    Client websocket that reconnects by itself whenever the connection is lost.
+
+    Reconnect attempts back off exponentially from ``min_delay`` up to ``max_delay`` and each
+    delay is drawn uniformly between zero and that bound ("full jitter"), so a fleet of clients
+    dropped at the same moment does not come back at the same moment. The first attempt after
+    a drop is delayed as well.
+
+    While disconnected, :meth:`send` keeps up to ``buffer_size`` messages, dropping the oldest,
+    and they are sent after ``on_connect`` has run on the new connection. :meth:`recv` waits
+    across reconnects and only returns ``None`` once :meth:`close` is called::
+
+        @asyncio.coroutine
+        def subscribe(websocket):
+            yield from websocket.send('subscribe prices')
+
+        client = ReconnectingWebsocket('ws://localhost:8000', on_connect=subscribe)
+        yield from client.start()
+
+    :param wsurl: Websocket uri passed to :func:`connect`.
+    :param min_delay: Backoff bound of the first attempt, in seconds.
+    :param max_delay: Largest backoff bound, in seconds.
+    :param factor: Growth of the backoff bound per failed attempt.
+    :param buffer_size: Messages kept while disconnected, ``0`` to raise instead.
+    :param on_connect: Coroutine function called with every new :class:`Websocket` before \
+        buffered messages are sent, e.g. to send subscriptions again.
+    :param kwds: Passed to :func:`connect`.
+    """
+    def __init__(self, wsurl, min_delay=0.5, max_delay=30.0, factor=2.0, buffer_size=0,
+                 on_connect=None, **kwds):
+        self.wsurl = wsurl
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.on_connect = on_connect
+        self.websocket = None
+        self.connections = 0
+        self.failed_attempts = 0
+        self.handshake = LatencyStats()
+        self.outage = LatencyStats()
+        self._kwds = kwds
+        self._buffer = collections.deque(maxlen=buffer_size) if buffer_size else None
+        self._connected = asyncio.Event()
+        self._closed = False
+        self._task = None
+
+
+    @property
+    def connected(self):
+        return self._connected.is_set()
+
+
+    @asyncio.coroutine
+    def start(self):
+        """
+        Start connecting and wait for the first connection.
+        """
+        self._task = asyncio.ensure_future(self._run())
+        yield from self._connected.wait()
+
+
+    @asyncio.coroutine
+    def send(self, data, flush=False):
+        """
+        Send a data frame, or buffer it while disconnected. See :meth:`Websocket.send`.
+
+        :raises ClosedException: When disconnected and there is no buffer.
+        """
+        websocket = self.websocket
+        if self._connected.is_set() and not websocket._closed:
+            yield from websocket.send(data, flush)
+        elif self._buffer is not None and not self._closed:
+            self._buffer.append(data)
+        else:
+            raise ClosedException(1006, 'not connected')
+
+
+    @asyncio.coroutine
+    def recv(self):
+        """
+        Receive the next frame, waiting through reconnects.
+
+        :return: Websocket text or data frame. Returns ``None`` once :meth:`close` has been called.
+        """
+        while not self._closed:
+            yield from self._connected.wait()
+            websocket = self.websocket
+            if self._closed:
+                break
+
+            item = yield from websocket.recv()
+            if item is not None:
+                return item
+
+            # make sure the connection is marked down before waiting for the next one
+            if websocket._recv_task is not None and not websocket._recv_task.done():
+                yield from asyncio.wait([websocket._recv_task])
+        return None
+
+
+    @asyncio.coroutine
+    def close(self, status=1000, reason=''):
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+        websocket = self.websocket
+        if websocket is not None and not websocket._closed:
+            yield from websocket.close(status, reason)
+            yield from websocket.wait_closed()
+        # wake up anybody waiting in recv
+        self._connected.set()
+
+
+    def _delay(self, attempt):
+        bound = min(self.max_delay, self.min_delay * self.factor ** attempt)
+        return random.uniform(0, bound)
+
+
+    def _disconnected(self, task):
+        self._connected.clear()
+
+
+    @asyncio.coroutine
+    def _run(self):
+        loop = asyncio.get_event_loop()
+        attempt = 0
+        lost = None
+        while not self._closed:
+            if lost is not None:
+                yield from asyncio.sleep(self._delay(attempt))
+
+            started = loop.time()
+            try:
+                websocket = yield from connect(self.wsurl, **self._kwds)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed_attempts += 1
+                attempt += 1
+                if lost is None:
+                    lost = started
+                continue
+
+            now = loop.time()
+            self.handshake.add(now - started)
+            if lost is not None:
+                self.outage.add(now - lost)
+            self.connections += 1
+            attempt = 0
+            self.websocket = websocket
+
+            try:
+                if self.on_connect is not None:
+                    yield from self.on_connect(websocket)
+                while self._buffer and not websocket._closed:
+                    yield from websocket.send(self._buffer.popleft())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                websocket.destroy()
+
+            if not websocket._closed:
+                websocket._recv_task.add_done_callback(self._disconnected)
+                self._connected.set()
+                yield from asyncio.wait([websocket._recv_task])
+
+            lost = loop.time()
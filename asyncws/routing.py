@@ -0,0 +1,118 @@
+__all__ = ['Router']
+
+
+class _Node:
+    __slots__ = ('children', 'param', 'param_node', 'wildcard', 'handler')
+
+    def __init__(self):
+        self.children = {}
+        self.param = None
+        self.param_node = None
+        self.wildcard = None
+        self.handler = None
+
+
+class Router:
+    """
+    Route table that maps request paths to websocket handlers.
+
+    Patterns without parameters are kept in a dictionary and matched with a single lookup.
+    The others are compiled into a trie of path segments, where a segment of the form
+    ``{name}`` matches any one segment and a trailing ``*`` matches the rest of the path.
+    Literal segments take precedence over parameters, and parameters over ``*``::
+
+        router = Router({
+            '/feed': feed,
+            '/chat/{room}': chat,
+            '/static/*': static,
+        })
+
+    The query string is ignored when matching. A :class:`Router` or a plain dictionary of
+    routes can be passed to :func:`start_server` in place of a single handler.
+
+    :param routes: Dictionary of pattern to handler.
+    """
+    def __init__(self, routes=None):
+        self._exact = {}
+        self._root = _Node()
+        if routes:
+            for pattern, handler in routes.items():
+                self.add(pattern, handler)
+
+
+    def add(self, pattern, handler):
+        """
+        Add a route, replacing any previous route with the same pattern.
+        """
+        if '{' not in pattern and not pattern.endswith('*'):
+            self._exact[pattern] = handler
+            return
+
+        node = self._root
+        segments = pattern.split('/')[1:]
+        for index, segment in enumerate(segments):
+            if segment == '*':
+                if index != len(segments) - 1:
+                    raise ValueError('* must be the last segment of a route')
+                node.wildcard = handler
+                return
+
+            if segment.startswith('{') and segment.endswith('}'):
+                name = segment[1:-1]
+                if node.param_node is None:
+                    node.param = name
+                    node.param_node = _Node()
+                elif node.param != name:
+                    raise ValueError('conflicting parameter names {0} and {1}'.format(node.param, name))
+                node = node.param_node
+            else:
+                child = node.children.get(segment)
+                if child is None:
+                    child = node.children[segment] = _Node()
+                node = child
+
+        node.handler = handler
+
+
+    def match(self, path):
+        """
+        Find the handler for ``path``.
+
+        :return: Tuple of handler and a dictionary of route parameters, ``None`` if no route matches.
+        """
+        path = path.split('?', 1)[0]
+        handler = self._exact.get(path)
+        if handler is not None:
+            return handler, {}
+
+        params = {}
+        handler = self._match(self._root, path.split('/')[1:], 0, params)
+        if handler is None:
+            return None
+        return handler, params
+
+
+    def _match(self, node, segments, index, params):
+        if index == len(segments):
+            if node.handler is not None:
+                return node.handler
+            return None
+
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            handler = self._match(child, segments, index + 1, params)
+            if handler is not None:
+                return handler
+
+        if node.param_node is not None and segment:
+            handler = self._match(node.param_node, segments, index + 1, params)
+            if handler is not None:
+                params[node.param] = segment
+                return handler
+
+        if node.wildcard is not None:
+            params['*'] = '/'.join(segments[index:])
+            return node.wildcard
+
+        return None
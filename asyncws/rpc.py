@@ -0,0 +1,258 @@
+import asyncio
+import itertools
+
+from .codec import RawCodec, get_codec
+from .exceptions import *
+
+__all__ = ['RPCConnection']
+
+# error codes borrowed from JSON-RPC 2.0
+_METHOD_NOT_FOUND = -32601
+_INTERNAL_ERROR = -32603
+
+
+def _valid_id(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+class RPCConnection:
+    """
+    Request/response calls multiplexed over one :class:`Websocket`, in either direction.
+
+    Every request carries an ``id`` that its response echoes, so any number of calls can be in
+    flight at once and their responses may arrive in any order. Incoming requests are handled
+    concurrently, each in its own task. Messages follow the shape of JSON-RPC 2.0::
+
+        {"id": 1, "method": "add", "params": [1, 2]}
+        {"id": 1, "result": 3}
+        {"id": 1, "error": {"code": -32601, "message": "method not found"}}
+        {"cancel": 1}
+
+    A request without an ``id`` is a notification and gets no response. Messages whose ``id`` is a
+    list or an object, and requests that repeat the ``id`` of one still running, are ignored. A
+    call that times out or is cancelled sends ``cancel`` so the other end stops working on it::
+
+        @asyncio.coroutine
+        def handler(websocket):
+            rpc = RPCConnection(websocket, {'add': lambda a, b: a + b})
+            yield from rpc.run()
+
+        rpc = RPCConnection(websocket)
+        rpc.start()
+        total = yield from rpc.call('add', 1, 2, timeout=5)
+
+    Handlers are plain functions or coroutine functions called with the request ``params``.
+    Raising :class:`RPCError` answers with its ``code`` and ``message``, any other exception with
+    the internal error code -32603.
+
+    :param websocket: :class:`Websocket` to run over.
+    :param handlers: Dictionary of method names to handlers, see also :meth:`register`.
+    :param codec: :class:`Codec` for the messages. Defaults to the websocket's own codec, or \
+        :class:`JsonCodec` when that is a :class:`RawCodec`.
+    :param timeout: Default seconds to wait for a response, ``None`` to wait forever.
+    :param max_concurrent: Most incoming requests handled at once, ``None`` for no limit.
+    """
+    def __init__(self, websocket, handlers=None, codec=None, timeout=None, max_concurrent=None):
+        if codec is None:
+            codec = websocket.codec
+            if isinstance(codec, RawCodec):
+                codec = get_codec('json')
+        self.websocket = websocket
+        self.codec = codec
+        self.timeout = timeout
+        self._handlers = dict(handlers or {})
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._running = {}
+        self._slots = asyncio.Semaphore(max_concurrent) if max_concurrent else None
+        self._task = None
+
+
+    @property
+    def pending(self):
+        """
+        Number of calls waiting for a response.
+        """
+        return len(self._pending)
+
+
+    def register(self, method, handler):
+        self._handlers[method] = handler
+
+
+    def start(self):
+        """
+        Start receiving in the background, see :meth:`run`.
+        """
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+
+    @asyncio.coroutine
+    def call(self, method, *params, timeout=None):
+        """
+        Call ``method`` at the other end and wait for its result.
+
+        :param timeout: Seconds to wait for the response, defaults to the connection's ``timeout``.
+        :raises RPCError: When the other end answered with an error.
+        :raises asyncio.TimeoutError: When there was no response in time.
+        :raises ClosedException: When the websocket closed before the response arrived.
+        """
+        if timeout is None:
+            timeout = self.timeout
+
+        request_id = next(self._ids)
+        future = asyncio.Future()
+        self._pending[request_id] = future
+        try:
+            yield from self._send({'id': request_id, 'method': method, 'params': list(params)})
+            return (yield from asyncio.wait_for(future, timeout))
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            if not self.websocket._closed:
+                asyncio.ensure_future(self._send_quietly({'cancel': request_id}))
+            raise
+        finally:
+            self._pending.pop(request_id, None)
+
+
+    @asyncio.coroutine
+    def notify(self, method, *params):
+        """
+        Call ``method`` at the other end without waiting for, or getting, a response.
+        """
+        yield from self._send({'method': method, 'params': list(params)})
+
+
+    @asyncio.coroutine
+    def run(self):
+        """
+        Receive and dispatch messages until the websocket is closed. Calls still waiting for a
+        response then fail with :class:`ClosedException` and running handlers are cancelled.
+        """
+        try:
+            while True:
+                data = yield from self.websocket.recv()
+                if data is None:
+                    break
+
+                try:
+                    message = self.codec.decode(data)
+                except Exception:
+                    continue
+                if isinstance(message, dict):
+                    self._dispatch(message)
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ClosedException(self.websocket.status, self.websocket.reason))
+            for task in list(self._running.values()):
+                task.cancel()
+
+
+    def close(self):
+        """
+        Stop receiving, see :meth:`run`. The websocket itself is left open.
+        """
+        if self._task is not None:
+            self._task.cancel()
+
+
+    def _dispatch(self, message):
+        # messages with ids that can not be looked up are dropped
+        if 'method' in message:
+            request_id = message.get('id')
+            if not _valid_id(request_id) or request_id in self._running:
+                return
+            task = asyncio.ensure_future(self._handle(request_id, message['method'], message.get('params')))
+            if request_id is not None:
+                self._running[request_id] = task
+                task.add_done_callback(lambda _: self._running.pop(request_id, None))
+
+        elif 'cancel' in message:
+            if not _valid_id(message['cancel']):
+                return
+            task = self._running.get(message['cancel'])
+            if task is not None:
+                task.cancel()
+
+        else:
+            if not _valid_id(message.get('id')):
+                return
+            future = self._pending.get(message.get('id'))
+            if future is None or future.done():
+                # the call already timed out or was cancelled
+                return
+            if 'error' in message:
+                error = message['error'] or {}
+                if not isinstance(error, dict):
+                    error = {'message': 'malformed error response'}
+                future.set_exception(RPCError(error.get('code', _INTERNAL_ERROR), error.get('message', '')))
+            else:
+                future.set_result(message.get('result'))
+
+
+    @asyncio.coroutine
+    def _handle(self, request_id, method, params):
+        if self._slots is not None:
+            yield from self._slots.acquire()
+        try:
+            handler = self._handlers.get(method)
+            if handler is None:
+                raise RPCError(_METHOD_NOT_FOUND, 'method not found')
+
+            if isinstance(params, dict):
+                result = handler(**params)
+            else:
+                result = handler(*(params or ()))
+            if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+                result = yield from result
+            response = {'id': request_id, 'result': result}
+
+        except asyncio.CancelledError:
+            return
+        except RPCError as exp:
+            response = {'id': request_id, 'error': {'code': exp.code, 'message': exp.message}}
+        except Exception as exp:
+            response = {'id': request_id, 'error': {'code': _INTERNAL_ERROR, 'message': str(exp)}}
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+        if request_id is None:
+            return
+
+        try:
+            data = self.codec.encode(response)
+        except Exception as exp:
+            # a result the codec can not encode still gets an answer
+            data = self.codec.encode({'id': request_id, 'error': {'code': _INTERNAL_ERROR, 'message': str(exp)}})
+
+        try:
+            yield from self._send_data(data)
+        except Exception:
+            pass
+
+
+    @asyncio.coroutine
+    def _send(self, message):
+        yield from self._send_data(self.codec.encode(message))
+
+
+    @asyncio.coroutine
+    def _send_data(self, data):
+        if self.websocket._closed:
+            raise ClosedException(self.websocket.status, self.websocket.reason)
+        yield from self.websocket.send(data)
+
+
+    @asyncio.coroutine
+    def _send_quietly(self, message):
+        try:
+            yield from self._send(message)
+        except Exception:
+            pass
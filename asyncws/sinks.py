@@ -0,0 +1,151 @@
+import os
+import mmap
+import tempfile
+
+from .exceptions import *
+
+__all__ = ['TemporaryFileSink', 'FileSink', 'MmapSink']
+
+
+def _limit(max_size, websocket, length):
+    # without a limit of its own a sink takes the connection's max_payload
+    if max_size is None:
+        max_size = websocket.max_payload
+    if length is not None and length > max_size:
+        raise ClosedException(1009, 'payload too large')
+    return max_size
+
+
+class _FileTarget:
+    def __init__(self, file, max_size, result):
+        self._file = file
+        self._max_size = max_size
+        self._result = result
+        self._size = 0
+
+    def write(self, data):
+        self._size += len(data)
+        if self._max_size is not None and self._size > self._max_size:
+            raise ClosedException(1009, 'payload too large')
+        self._file.write(data)
+
+    def finish(self):
+        return self._result(self._file)
+
+    def abort(self):
+        self._file.close()
+
+
+class TemporaryFileSink:
+    """
+    Write large binary messages to an anonymous temporary file.
+
+    :meth:`Websocket.recv` returns the open file object positioned at the start of the payload.
+    The file is deleted as soon as it is closed.
+
+    :param dir: Directory the temporary file is created in.
+    :param max_size: Largest message accepted, ``None`` for the websocket's ``max_payload``.
+    """
+    def __init__(self, dir=None, max_size=None):
+        self.dir = dir
+        self.max_size = max_size
+
+    def open(self, websocket, length):
+        max_size = _limit(self.max_size, websocket, length)
+        return _FileTarget(tempfile.TemporaryFile(dir=self.dir), max_size, self._rewind)
+
+    @staticmethod
+    def _rewind(file):
+        file.flush()
+        file.seek(0)
+        return file
+
+
+class FileSink:
+    """
+    Write large binary messages to named files.
+
+    :meth:`Websocket.recv` returns the path of the completed file, which belongs to the
+    application from then on. Files of messages that are cut short are removed.
+
+    :param dir: Directory the files are created in.
+    :param prefix: File name prefix.
+    :param suffix: File name suffix.
+    :param max_size: Largest message accepted, ``None`` for the websocket's ``max_payload``.
+    """
+    def __init__(self, dir=None, prefix='asyncws-', suffix='', max_size=None):
+        self.dir = dir
+        self.prefix = prefix
+        self.suffix = suffix
+        self.max_size = max_size
+
+    def open(self, websocket, length):
+        max_size = _limit(self.max_size, websocket, length)
+        file = tempfile.NamedTemporaryFile(
+            dir=self.dir, prefix=self.prefix, suffix=self.suffix, delete=False)
+        return _NamedFileTarget(file, max_size)
+
+
+class _NamedFileTarget(_FileTarget):
+    def __init__(self, file, max_size):
+        _FileTarget.__init__(self, file, max_size, self._close)
+
+    @staticmethod
+    def _close(file):
+        file.close()
+        return file.name
+
+    def abort(self):
+        self._file.close()
+        os.unlink(self._file.name)
+
+
+class MmapSink:
+    """
+    Write large binary messages into anonymous memory maps.
+
+    The map is sized from the frame header when the message is not fragmented, otherwise
+    it starts at ``size`` and grows as needed. Messages claiming more than ``max_size`` are
+    refused before anything is allocated. :meth:`Websocket.recv` returns a ``memoryview``
+    of the payload.
+
+    :param size: Initial size of the map for fragmented messages.
+    :param max_size: Largest message accepted, ``None`` for the websocket's ``max_payload``.
+    """
+    def __init__(self, size=1048576, max_size=None):
+        self.size = size
+        self.max_size = max_size
+
+    def open(self, websocket, length):
+        max_size = _limit(self.max_size, websocket, length)
+        return _MmapTarget(min(length or self.size, max_size), max_size)
+
+
+class _MmapTarget:
+    def __init__(self, size, max_size):
+        self._map = mmap.mmap(-1, max(size, 1))
+        self._max_size = max_size
+        self._size = 0
+
+    def write(self, data):
+        end = self._size + len(data)
+        if self._max_size is not None and end > self._max_size:
+            raise ClosedException(1009, 'payload too large')
+
+        if end > len(self._map):
+            size = len(self._map) * 2
+            if self._max_size is not None:
+                size = min(size, self._max_size)
+            grown = mmap.mmap(-1, max(end, size))
+            grown[:self._size] = self._map[:self._size]
+            self._map.close()
+            self._map = grown
+
+        self._map[self._size:end] = data
+        self._size = end
+
+    def finish(self):
+        return memoryview(self._map)[:self._size]
+
+    def abort(self):
+        self._map.close()
@@ -0,0 +1,129 @@
+import ssl
+import time
+import collections
+
+__all__ = ['ClientSSLContext', 'configure_session_tickets']
+
+
+class ClientSSLContext(ssl.SSLContext):
+    """
+    Client SSL context that resumes TLS sessions with servers it has connected to before.
+
+    Resuming skips the certificate exchange and key agreement of a full handshake, which makes
+    reconnecting faster and cheaper for both ends. :func:`connect` remembers the session of every
+    ``wss://`` connection made with this context by server name, and offers it again on the next
+    connection to the same name until the server's lifetime for it runs out.
+
+    :func:`connect` uses a shared instance with the system's trusted certificates for ``wss://``
+    uris when no ``ssl`` context is given. Pass your own to trust other certificates::
+
+        context = ClientSSLContext()
+        context.load_verify_locations('example.crt')
+        websocket = yield from connect('wss://localhost:8000', ssl=context)
+
+    Sessions are only resumed on Python 3.6 and later, older versions always make a full
+    handshake.
+
+    :param protocol: See `SSLContext <https://docs.python.org/3/library/ssl.html#ssl.SSLContext>`_, \
+        ``None`` for a client context that verifies hostnames and certificates.
+    :param cache_size: Number of server names whose session is remembered.
+    """
+    def __new__(cls, protocol=None, cache_size=256):
+        if protocol is None:
+            # PROTOCOL_TLS_CLIENT is new in Python 3.6
+            protocol = getattr(ssl, 'PROTOCOL_TLS_CLIENT', ssl.PROTOCOL_SSLv23)
+        return super().__new__(cls, protocol)
+
+    def __init__(self, protocol=None, cache_size=256):
+        super().__init__()
+        if protocol is None and not hasattr(ssl, 'PROTOCOL_TLS_CLIENT'):
+            self.verify_mode = ssl.CERT_REQUIRED
+            self.check_hostname = True
+        self.cache_size = cache_size
+        self.handshakes = 0
+        self.resumed = 0
+        self._sessions = collections.OrderedDict()
+
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = self._session(server_hostname)
+        if session is None:
+            return super().wrap_bio(incoming, outgoing, server_side, server_hostname)
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+
+
+    def remember(self, ssl_object):
+        """
+        Keep the session of an established connection for the next one to the same server.
+
+        :param ssl_object: ``get_extra_info('ssl_object')`` of the connection.
+        """
+        if ssl_object is None:
+            return
+
+        self.handshakes += 1
+        if getattr(ssl_object, 'session_reused', False):
+            self.resumed += 1
+
+        session = getattr(ssl_object, 'session', None)
+        if session is None or ssl_object.server_hostname is None:
+            return
+        self._sessions[ssl_object.server_hostname] = session
+        self._sessions.move_to_end(ssl_object.server_hostname)
+        if len(self._sessions) > self.cache_size:
+            self._sessions.popitem(last=False)
+
+
+    def forget(self, server_hostname=None):
+        """
+        Drop the session remembered for ``server_hostname``, or all of them.
+        """
+        if server_hostname is None:
+            self._sessions.clear()
+        else:
+            self._sessions.pop(server_hostname, None)
+
+
+    def _session(self, server_hostname):
+        session = self._sessions.get(server_hostname)
+        if session is not None and session.time + session.timeout <= time.time():
+            del self._sessions[server_hostname]
+            session = None
+        return session
+
+
+_default_context = None
+
+
+def _default_ssl_context():
+    global _default_context
+    if _default_context is None:
+        _default_context = ClientSSLContext()
+        _default_context.load_default_certs()
+    return _default_context
+
+
+def configure_session_tickets(context, tickets=2):
+    """
+    Set how many TLS session tickets a server context hands to each client, ``0`` to turn
+    session resumption off. Also available as the ``session_tickets`` option of
+    :func:`start_server`.
+
+    Tickets are encrypted with a key OpenSSL makes up when the context is created, so only the
+    process that issued a ticket can resume it. Clients of servers spread over several processes
+    resume only when they reconnect to the same process.
+
+    :param context: Server side ``SSLContext``, modified in place.
+    :param tickets: Tickets sent after each full TLS 1.3 handshake.
+    :return: ``context``
+    """
+    # OP_NO_TICKET is new in Python 3.6, before that OpenSSL's value is used
+    no_ticket = getattr(ssl, 'OP_NO_TICKET', 0x4000)
+    if tickets:
+        context.options &= ~no_ticket
+    else:
+        context.options |= no_ticket
+    if hasattr(context, 'num_tickets'):
+        context.num_tickets = tickets
+    return context
@@ -0,0 +1,160 @@
+import time
+import collections
+
+__all__ = ['Tracer', 'LatencyStats']
+
+_EVENTS = ('handshake_start', 'handshake_end', 'frame_received', 'message_enqueued',
+           'message_dequeued', 'frame_sent', 'drain_complete')
+
+
+class LatencyStats:
+    """
+    Running count, mean and maximum of a latency, in seconds.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+
+class Tracer:
+    """
+    Event hooks for following messages through a websocket.
+
+    Pass a tracer to :func:`start_server` or :func:`connect` with the ``tracer`` keyword, or call
+    :meth:`attach`, and subscribe callbacks to any of these events:
+
+    ``handshake_start``, ``handshake_end``
+        Opening handshake, ``handshake_end`` carries its ``duration`` and any ``error``.
+    ``frame_received``, ``frame_sent``
+        Every frame with its ``opcode``, ``fin`` flag and ``length``.
+    ``message_enqueued``, ``message_dequeued``
+        A complete message entering and leaving the receive queue with its ``length``, the bytes
+        written to the sink for messages received into a binary sink. ``message_dequeued`` also
+        carries the ``queue_wait`` it spent there.
+    ``drain_complete``
+        The transport buffer drained after a flushed send, with the ``send_to_drain`` time since
+        the send started.
+
+    Callbacks are called as ``callback(event, websocket, timestamp, info)`` where ``timestamp``
+    comes from ``time.monotonic()`` and ``info`` is a dictionary of the values above.
+    Websockets without a tracer pay a single ``None`` check per frame, and events nobody
+    subscribed to are not built. The derived latencies are also aggregated in
+    :attr:`handshake`, :attr:`queue_wait` and :attr:`send_to_drain`.
+    """
+    def __init__(self):
+        self._hooks = {}
+        self.handshake = LatencyStats()
+        self.queue_wait = LatencyStats()
+        self.send_to_drain = LatencyStats()
+
+
+    def subscribe(self, event, callback):
+        if event not in _EVENTS:
+            raise ValueError('unknown event {0}'.format(event))
+        self._hooks.setdefault(event, []).append(callback)
+
+
+    def unsubscribe(self, event, callback):
+        callbacks = self._hooks.get(event)
+        if callbacks and callback in callbacks:
+            callbacks.remove(callback)
+            if not callbacks:
+                del self._hooks[event]
+
+
+    def attach(self, websocket):
+        """
+        Start tracing ``websocket``.
+        """
+        trace = _Trace(self, websocket)
+        websocket.trace = trace
+        websocket._frame_writer.trace = trace
+        return trace
+
+
+    def _emit(self, event, websocket, timestamp, info):
+        for callback in self._hooks.get(event, ()):
+            callback(event, websocket, timestamp, info)
+
+
+class _Trace:
+    __slots__ = ('tracer', 'websocket', '_enqueued', '_handshake_started')
+
+    def __init__(self, tracer, websocket):
+        self.tracer = tracer
+        self.websocket = websocket
+        self._enqueued = collections.deque()
+        self._handshake_started = None
+
+    def handshake_start(self, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self._handshake_started = timestamp
+        if 'handshake_start' in self.tracer._hooks:
+            self.tracer._emit('handshake_start', self.websocket, timestamp, {})
+
+    def handshake_end(self, error=None, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        duration = timestamp - self._handshake_started
+        self.tracer.handshake.add(duration)
+        if 'handshake_end' in self.tracer._hooks:
+            self.tracer._emit('handshake_end', self.websocket, timestamp,
+                              {'duration': duration, 'error': error})
+
+    def frame_received(self, fin, opcode, length):
+        if 'frame_received' in self.tracer._hooks:
+            self.tracer._emit('frame_received', self.websocket, time.monotonic(),
+                              {'fin': fin, 'opcode': opcode, 'length': length})
+
+    def message_enqueued(self, item, length=None):
+        timestamp = time.monotonic()
+        self._enqueued.append(timestamp)
+        if 'message_enqueued' in self.tracer._hooks:
+            if length is None:
+                length = _length(item)
+            self.tracer._emit('message_enqueued', self.websocket, timestamp, {'length': length})
+
+    def message_dequeued(self, item, length=None):
+        timestamp = time.monotonic()
+        queue_wait = timestamp - self._enqueued.popleft() if self._enqueued else 0.0
+        self.tracer.queue_wait.add(queue_wait)
+        if 'message_dequeued' in self.tracer._hooks:
+            if length is None:
+                length = _length(item)
+            self.tracer._emit('message_dequeued', self.websocket, timestamp,
+                              {'length': length, 'queue_wait': queue_wait})
+
+    def frame_sent(self, fin, opcode, length):
+        if 'frame_sent' in self.tracer._hooks:
+            self.tracer._emit('frame_sent', self.websocket, time.monotonic(),
+                              {'fin': fin, 'opcode': opcode, 'length': length})
+
+    def drain_complete(self, started):
+        timestamp = time.monotonic()
+        send_to_drain = timestamp - started
+        self.tracer.send_to_drain.add(send_to_drain)
+        if 'drain_complete' in self.tracer._hooks:
+            self.tracer._emit('drain_complete', self.websocket, timestamp,
+                              {'send_to_drain': send_to_drain})
+
+
+def _length(item):
+    try:
+        return len(item)
+    except TypeError:
+        # file objects handed back by a binary sink
+        return None
@@ -0,0 +1,68 @@
+import os
+import time
+import asyncio
+import asyncws
+
+MESSAGES = 20000
+SIZE = 256
+SOCKET_PATH = '/tmp/asyncws-bench.sock'
+
+
+@asyncio.coroutine
+def echo(websocket):
+    while True:
+        frame = yield from websocket.recv()
+        if frame is None:
+            break
+        yield from websocket.send(frame)
+
+
+@asyncio.coroutine
+def run(url):
+    websocket = yield from asyncws.connect(url)
+    payload = b'x' * SIZE
+
+    # round trips measure latency, the pipelined run measures throughput
+    start = time.perf_counter()
+    for _ in range(MESSAGES // 10):
+        yield from websocket.send(payload)
+        yield from websocket.recv()
+    round_trip = (time.perf_counter() - start) / (MESSAGES // 10)
+
+    start = time.perf_counter()
+    received = 0
+    for _ in range(MESSAGES):
+        yield from websocket.send(payload)
+    while received < MESSAGES:
+        batch = yield from websocket.recv_many()
+        received += len(batch)
+    throughput = MESSAGES / (time.perf_counter() - start)
+
+    yield from websocket.close()
+    yield from websocket.wait_closed()
+    return round_trip, throughput
+
+
+@asyncio.coroutine
+def bench():
+    if os.path.exists(SOCKET_PATH):
+        os.unlink(SOCKET_PATH)
+
+    tcp_server = yield from asyncws.start_server(echo, '127.0.0.1', 8000)
+    unix_server = yield from asyncws.start_server(echo, path=SOCKET_PATH)
+
+    for name, url in (('tcp loopback', 'ws://127.0.0.1:8000'),
+                      ('unix socket', 'ws+unix://' + SOCKET_PATH)):
+        round_trip, throughput = yield from run(url)
+        print('%-13s round trip %7.1f us   pipelined %9.0f msg/s' % (name, round_trip * 1e6, throughput))
+
+    for server in (tcp_server, unix_server):
+        server.close()
+        yield from server.wait_closed()
+
+
+loop = asyncio.get_event_loop()
+try:
+    loop.run_until_complete(bench())
+finally:
+    loop.close()